@@ -1,8 +1,7 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import sys
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 load_dotenv()
 
@@ -11,7 +10,14 @@ api_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'api')
 if api_dir not in sys.path:
     sys.path.insert(0, api_dir)
 
-from openai_helper import create_openai_request
+from openai_helper import (
+    _supports_web_search,
+    acreate_openai_request,
+    create_openai_request,
+    get_async_openai_client,
+    get_openai_client,
+    with_retries,
+)
 
 
 class ChatOpenAI:
@@ -35,6 +41,15 @@ class ChatOpenAI:
         else:
             self.base_url = None  # Use default OpenAI base URL
 
+        # Clients are cached per (api_key, base_url) and share one HTTP pool,
+        # so connections stay warm across calls and across instances.
+        self._client = get_openai_client(self.api_key, self.base_url)
+
+    @property
+    def _aclient(self):
+        """Cached async client for the running event loop (async pools are loop-bound)."""
+        return get_async_openai_client(self.api_key, self.base_url)
+
     def run(self, messages, model_name: str = "gpt-5-mini", text_only: bool = True, **kwargs):
         if not isinstance(messages, list):
             raise ValueError("messages must be a list")
@@ -47,6 +62,7 @@ class ChatOpenAI:
             model=model_name,
             messages=messages,
             stream=False,
+            client=self._client,
             **kwargs
         )
 
@@ -64,64 +80,45 @@ class ChatOpenAI:
         if not isinstance(messages, list):
             raise ValueError("messages must be a list")
 
-        # Create OpenAI client
-        client_kwargs = {"api_key": self.api_key}
-        if self.base_url:
-            client_kwargs["base_url"] = self.base_url
-
-        client = OpenAI(**client_kwargs)
+        response = await with_retries(lambda: acreate_openai_request(
+            api_key=self.api_key,
+            provider=self.provider,
+            model=model_name,
+            messages=messages,
+            stream=False,
+            client=self._aclient,
+            **kwargs
+        ))
 
-        # Check if this is a GPT-5 model that supports web search
-        GPT5_WEB_SEARCH_MODELS = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
-        is_gpt5_with_web_search = self.provider == "openai" and model_name in GPT5_WEB_SEARCH_MODELS
+        if text_only:
+            if _supports_web_search(self.provider, model_name):
+                return response.output_text
+            return response.choices[0].message.content
+        return response
 
-        # Pop web_search from kwargs so it's never forwarded raw to the API
-        web_search = kwargs.pop("web_search", None)
+    async def astream(self, messages, model_name: str = "gpt-5-mini", **kwargs) -> AsyncIterator[str]:
+        """Stream response text incrementally instead of waiting for the full answer.
 
-        if is_gpt5_with_web_search:
-            # For GPT-5 models, use Responses API
-            if len(messages) == 1:
-                input_text = messages[0]["content"]
-            else:
-                # Format multi-turn conversation
-                formatted_parts = []
-                for msg in messages:
-                    role = msg["role"]
-                    content = msg["content"]
-                    if role == "system":
-                        formatted_parts.append(f"System: {content}")
-                    elif role == "user":
-                        formatted_parts.append(f"User: {content}")
-                    elif role == "assistant":
-                        formatted_parts.append(f"Assistant: {content}")
-                input_text = "\n\n".join(formatted_parts)
-
-            request_params = {
-                "model": model_name,
-                "input": input_text,
-                **kwargs
-            }
-
-            # Only add web_search tool when not explicitly disabled (default: enabled)
-            if web_search is not False:
-                request_params["tools"] = [{"type": "web_search"}]
-
-            response = await client.responses.create(**request_params)
-
-            if text_only:
-                return response.output_text
-            return response
-        else:
-            # For Together.ai and other models, use Chat Completions API
-            # (web_search already popped above, so it won't be forwarded)
-            request_params = {
-                "model": model_name,
-                "messages": messages,
-                **kwargs
-            }
+        Handles both Responses API events (GPT-5 models) and Chat Completions chunks.
+        """
+        if not isinstance(messages, list):
+            raise ValueError("messages must be a list")
 
-            response = await client.chat.completions.create(**request_params)
+        stream = await with_retries(lambda: acreate_openai_request(
+            api_key=self.api_key,
+            provider=self.provider,
+            model=model_name,
+            messages=messages,
+            stream=True,
+            client=self._aclient,
+            **kwargs
+        ))
 
-            if text_only:
-                return response.choices[0].message.content
-            return response
\ No newline at end of file
+        if _supports_web_search(self.provider, model_name):
+            async for event in stream:
+                if getattr(event, "type", None) == "response.output_text.delta" and event.delta:
+                    yield event.delta
+        else:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
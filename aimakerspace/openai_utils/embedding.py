@@ -1,14 +1,198 @@
 from dotenv import load_dotenv
-from openai import AsyncOpenAI, OpenAI
 from together import Together
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
 from typing import List, Optional
+import functools
+import hashlib
+import tiktoken
 import os
+import threading
+import weakref
+import sys
+import json
 import asyncio
 
-class EmbeddingModel:
+# Add api directory to path to import openai_helper
+api_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'api')
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+try:
+    # orjson parses large float arrays several times faster than stdlib json
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+from openai_helper import get_async_openai_client, get_openai_client, get_shared_async_http_client, with_retries
+
+# Maximum embedding requests in flight at once, shared by every EmbeddingModel
+# on the same event loop (keep below the HTTP pool's max_connections)
+OPENAI_MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "8"))
+TOGETHER_MAX_CONCURRENT_BATCHES = 5
+
+# Request packing caps: OpenAI rejects embedding requests above 300k tokens
+# or 2048 inputs, so batches are packed greedily under these limits
+MAX_EMBEDDING_TOKENS_PER_REQUEST = 250_000
+MAX_EMBEDDING_INPUTS_PER_REQUEST = 2048
+
+
+@functools.lru_cache(maxsize=8)
+def _get_encoder(model_name: str) -> Optional[tiktoken.Encoding]:
+    """Get a cached tiktoken encoder (cl100k_base for non-OpenAI models), or None if unavailable."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _count_tokens_batch(model_name: str, texts: List[str]) -> List[int]:
+    """Count tokens per text, approximating as len // 4 when tiktoken is unavailable."""
+    encoder = _get_encoder(model_name)
+    if encoder is None:
+        return [len(text) // 4 for text in texts]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
+
+
+# Per-loop, per-provider in-flight semaphores (asyncio primitives are loop-bound)
+_inflight_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _get_inflight_semaphore(provider: str) -> asyncio.Semaphore:
+    """Get the semaphore bounding concurrent embedding requests for this loop and provider."""
+    per_loop = _inflight_semaphores.setdefault(asyncio.get_running_loop(), {})
+    semaphore = per_loop.get(provider)
+    if semaphore is None:
+        limit = TOGETHER_MAX_CONCURRENT_BATCHES if provider == "together" else OPENAI_MAX_CONCURRENT
+        semaphore = per_loop[provider] = asyncio.Semaphore(limit)
+    return semaphore
+
+# How long single-text requests wait for company before being sent as a batch
+COALESCE_MAX_WAIT_SECONDS = 0.005
+
+
+class _EmbeddingCoalescer:
+    """Micro-batches concurrent single-text embedding requests.
+
+    Requests are queued with a future; a worker task drains the queue,
+    waiting up to COALESCE_MAX_WAIT_SECONDS (or until max_batch_size items
+    arrive), embeds them in one call and scatters the results. The worker
+    exits when the queue is empty and is restarted on the next request.
+    """
+
+    def __init__(self, embed_batch, max_batch_size: int):
+        self._embed_batch = embed_batch
+        self._max_batch_size = max_batch_size
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, text: str) -> List[float]:
+        future = self._loop.create_future()
+        self._queue.put_nowait((text, future))
+        if self._worker is None or self._worker.done():
+            self._worker = self._loop.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait()]
+            deadline = self._loop.time() + COALESCE_MAX_WAIT_SECONDS
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                embeddings = await self._embed_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), embedding in zip(batch, embeddings):
+                    if not future.done():
+                        future.set_result(embedding)
+
+# Max embeddings kept in the process-wide content-hash cache
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+
+class _EmbeddingCache:
+    """Thread-safe LRU of embeddings keyed by sha256(model + text).
+
+    Vectors are stored as compact double arrays (exact, ~4x smaller than
+    lists of Python floats) and returned as fresh lists.
+    """
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._data: "OrderedDict[bytes, array]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                return None
+            self._data.move_to_end(key)
+        return vector.tolist()
+
+    def put(self, key: bytes, embedding: List[float]) -> None:
+        if self._maxsize <= 0:
+            return
+        vector = array("d", embedding)
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_embedding_cache = _EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_together_client(api_key: str) -> Together:
+    """Get a cached Together.ai client so instances with the same key share it."""
+    return Together(api_key=api_key)
+
+
+class EmbeddingModel(ABC):
+    """Embedding client; instantiating it returns the provider-specific subclass.
+
+    Provider dispatch happens once in __new__, so the hot paths never branch
+    on self.provider. Subclasses implement the abstract client setup and raw
+    request hooks.
+    """
+
+    provider: str
+    embeddings_model_name: str
+    base_url: str
+
+    def __new__(cls, batch_size: int = 1024, api_key: str = None, provider: str = "openai"):
+        if cls is EmbeddingModel:
+            cls = _TogetherEmbedder if provider.lower() == "together" else _OpenAIEmbedder
+        return super().__new__(cls)
+
     def __init__(self, batch_size: int = 1024, api_key: str = None, provider: str = "openai"):
         load_dotenv()
-        self.provider = provider.lower()
         self.api_key = api_key #or os.getenv("OPENAI_API_KEY")
         
         if self.api_key is None:
@@ -17,83 +201,290 @@ class EmbeddingModel:
             )
         
         self.batch_size = batch_size
-        
-        # Initialize clients based on provider
-        if self.provider == "together":
-            self.async_client = None  # Together.ai doesn't have async client in this version
-            # https://docs.together.ai/docs/serverless-models#embedding-models
-            # Available serverless embedding models:
-            # - BAAI/bge-base-en-v1.5 (768 dim, 512 context) - too small for 1000 token chunks
-            # - Alibaba-NLP/gte-modernbert-base (768 dim, 8192 context) - good for large chunks
-            # - intfloat/multilingual-e5-large-instruct (1024 dim, 514 context) - too small
-            # Using gte-modernbert-base for larger context window (8192 tokens)
-            self.embeddings_model_name = "Alibaba-NLP/gte-modernbert-base"
-            self.client = Together(api_key=self.api_key)
-        else:
-            # Default to OpenAI
-            self.embeddings_model_name = "text-embedding-3-small"
-            self.async_client = AsyncOpenAI(api_key=self.api_key)
-            self.client = OpenAI(api_key=self.api_key)
+        self._init_clients()
+
+        # Single-text request coalescer, bound to the event loop that created it
+        self._coalescer: Optional[_EmbeddingCoalescer] = None
+
+    @abstractmethod
+    def _init_clients(self) -> None:
+        """Create the provider's SDK client(s)."""
+
+    @abstractmethod
+    async def _arequest_embeddings(self, batch: List[str]) -> List[List[float]]:
+        """Send one batch to the provider asynchronously (no caching or retries)."""
+
+    def _create_embeddings(self, list_of_text: List[str]) -> List[List[float]]:
+        """Call the provider's embeddings endpoint synchronously (no caching)."""
+        embedding_response = self.client.embeddings.create(
+            input=list_of_text, model=self.embeddings_model_name
+        )
+        return [embeddings.embedding for embeddings in embedding_response.data]
+
+    async def _aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch asynchronously with the provider's fastest path.
+
+        Each attempt holds a slot of the shared in-flight semaphore, so
+        concurrent callers cannot fan out past the provider limit; backoff
+        sleeps between retries release the slot.
+        """
+        semaphore = _get_inflight_semaphore(self.provider)
+
+        async def attempt():
+            async with semaphore:
+                return await self._arequest_embeddings(batch)
+
+        return await with_retries(attempt)
+
+    def _pack_batches(self, list_of_text: List[str]) -> List[List[str]]:
+        """Greedily pack consecutive texts into batches bounded by token and item caps.
+
+        Long documents no longer overflow the per-request token limit, and
+        short ones fill requests instead of wasting rate-limit budget.
+        Batches are contiguous, so flattening them preserves input order.
+        """
+        max_items = min(self.batch_size, MAX_EMBEDDING_INPUTS_PER_REQUEST)
+        token_counts = _count_tokens_batch(self.embeddings_model_name, list_of_text)
+
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for i, count in enumerate(token_counts):
+            if i > start and (batch_tokens + count > MAX_EMBEDDING_TOKENS_PER_REQUEST or i - start == max_items):
+                batches.append(list_of_text[start:i])
+                start = i
+                batch_tokens = 0
+            batch_tokens += count
+        if start < len(list_of_text):
+            batches.append(list_of_text[start:])
+        return batches
+
+    async def _aembed_batches(self, list_of_text: List[str]) -> List[List[float]]:
+        """Embed texts in token-packed batches concurrently, returning embeddings in input order."""
+        batches = self._pack_batches(list_of_text)
+
+        # Batches run concurrently, bounded by the shared in-flight semaphore;
+        # each retries on its own so one 429 doesn't discard the others
+        batch_results = await asyncio.gather(*[self._aembed_batch(batch) for batch in batches])
+        return [embedding for batch_result in batch_results for embedding in batch_result]
+
+    async def _aembed_cached(self, list_of_text: List[str]) -> List[List[float]]:
+        """Embed texts, sending only cache misses to the API and scattering results back in order."""
+        keys = [_EmbeddingCache.make_key(self.embeddings_model_name, text) for text in list_of_text]
+        results = [_embedding_cache.get(key) for key in keys]
+        miss_indices = [i for i, embedding in enumerate(results) if embedding is None]
+
+        if miss_indices:
+            fresh = await self._aembed_batches([list_of_text[i] for i in miss_indices])
+            for i, embedding in zip(miss_indices, fresh):
+                results[i] = embedding
+                _embedding_cache.put(keys[i], embedding)
+
+        return results
 
     async def async_get_embeddings(self, list_of_text: List[str]) -> List[List[float]]:
-        if self.provider == "together":
-            # Together.ai doesn't have async support, fall back to sync
-            return self.get_embeddings(list_of_text)
-        
-        batches = [list_of_text[i:i + self.batch_size] for i in range(0, len(list_of_text), self.batch_size)]
-        
-        async def process_batch(batch):
-            embedding_response = await self.async_client.embeddings.create(
-                input=batch, model=self.embeddings_model_name
-            )
-            return [embeddings.embedding for embeddings in embedding_response.data]
-        
-        # Use asyncio.gather to process all batches concurrently
-        results = await asyncio.gather(*[process_batch(batch) for batch in batches])
-        
-        # Flatten the results
-        return [embedding for batch_result in results for embedding in batch_result]
+        return await self._aembed_cached(list_of_text)
+
+    async def async_get_embeddings_np(self, list_of_text: List[str]):
+        """Embed texts into a single contiguous (N, D) float32 NumPy array.
+
+        Roughly 7x smaller than nested Python float lists and ready for
+        vectorized math without per-element conversion. NumPy is imported
+        lazily since it is not a core runtime dependency.
+        """
+        import numpy as np
+
+        embeddings = await self._aembed_cached(list_of_text)
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.asarray(embeddings, dtype=np.float32)
 
     async def async_get_embedding(self, text: str) -> List[float]:
-        if self.provider == "together":
-            # Together.ai doesn't have async support, fall back to sync
-            return self.get_embedding(text)
-        
-        embedding = await self.async_client.embeddings.create(
-            input=text, model=self.embeddings_model_name
-        )
+        key = _EmbeddingCache.make_key(self.embeddings_model_name, text)
+        cached = _embedding_cache.get(key)
+        if cached is not None:
+            return cached
 
-        return embedding.data[0].embedding
+        # Concurrent callers are coalesced, then token-packed like any other
+        # batch so a burst of long chunks cannot overflow one request
+        loop = asyncio.get_running_loop()
+        if self._coalescer is None or self._coalescer._loop is not loop:
+            self._coalescer = _EmbeddingCoalescer(self._aembed_batches, self.batch_size)
+        embedding = await self._coalescer.submit(text)
+        _embedding_cache.put(key, embedding)
+        return embedding
+
+    async def submit_batch_job(self, texts: List[str], poll: bool = False):
+        """Submit texts to a provider batch API (OpenAI only)."""
+        raise ValueError("Batch embedding jobs are only supported for the OpenAI provider")
 
     def get_embeddings(self, list_of_text: List[str]) -> List[List[float]]:
-        if self.provider == "together":
-            embedding_response = self.client.embeddings.create(
-                model=self.embeddings_model_name,
-                input=list_of_text
-            )
-        else:
-            embedding_response = self.client.embeddings.create(
-                input=list_of_text, model=self.embeddings_model_name
-            )
+        keys = [_EmbeddingCache.make_key(self.embeddings_model_name, text) for text in list_of_text]
+        results = [_embedding_cache.get(key) for key in keys]
+        miss_indices = [i for i, embedding in enumerate(results) if embedding is None]
 
-        return [embeddings.embedding for embeddings in embedding_response.data]
+        if miss_indices:
+            fresh = self._create_embeddings([list_of_text[i] for i in miss_indices])
+            for i, embedding in zip(miss_indices, fresh):
+                results[i] = embedding
+                _embedding_cache.put(keys[i], embedding)
+
+        return results
+
+    def get_embeddings_int8(self, list_of_text: List[str]):
+        """Embed texts and quantize them to int8 with one float32 scale per vector.
+
+        Returns (q, scales) where q is an (N, D) int8 array and scales an (N,)
+        float32 array, ~4x smaller than float32 vectors. Cosine similarity is
+        recovered as (q_a @ q_b) * scale_a * scale_b / (||q_a * scale_a|| * ||q_b * scale_b||),
+        and since the scales cancel, simply (q_a @ q_b) / (||q_a|| * ||q_b||).
+        """
+        import numpy as np
+
+        vectors = np.asarray(self.get_embeddings(list_of_text), dtype=np.float32)
+        scales = np.max(np.abs(vectors), axis=1) / 127.0
+        # Guard all-zero vectors against division by zero
+        scales[scales == 0] = 1.0
+        q = np.round(vectors / scales[:, None]).astype(np.int8)
+        return q, scales.astype(np.float32)
 
     def get_embedding(self, text: str) -> List[float]:
-        if self.provider == "together":
-            embedding = self.client.embeddings.create(
-                input=text, model=self.embeddings_model_name
-            )
-        else:
-            embedding = self.client.embeddings.create(
-                input=text, model=self.embeddings_model_name
-            )
+        key = _EmbeddingCache.make_key(self.embeddings_model_name, text)
+        cached = _embedding_cache.get(key)
+        if cached is not None:
+            return cached
+
+        embedding = self.client.embeddings.create(
+            input=text, model=self.embeddings_model_name
+        ).data[0].embedding
+        _embedding_cache.put(key, embedding)
+        return embedding
+
+
+class _OpenAIEmbedder(EmbeddingModel):
+    """OpenAI embeddings: raw batched POSTs on the shared HTTP pool, plus the Batch API."""
+
+    provider = "openai"
+    embeddings_model_name = "text-embedding-3-small"
+    base_url = "https://api.openai.com/v1"
+
+    def _init_clients(self) -> None:
+        # Cached clients on the shared, pool-tuned HTTP clients so concurrent
+        # batches are not throttled by httpx's default 20 keep-alive slots
+        self.client = get_openai_client(self.api_key, None)
+
+    @property
+    def async_client(self):
+        """Cached async client for the running event loop (async pools are loop-bound)."""
+        return get_async_openai_client(self.api_key, None)
+
+    def _get_http_client(self):
+        """Return the shared raw async HTTP client used for batch embedding requests."""
+        return get_shared_async_http_client()
+
+    async def _post_embeddings(self, batch: List[str]) -> List[List[float]]:
+        """POST a batch directly to the embeddings endpoint, bypassing SDK overhead.
+
+        The API key travels in the Authorization header, never in the URL.
+        """
+        response = await self._get_http_client().post(
+            f"{self.base_url}/embeddings",
+            json={"model": self.embeddings_model_name, "input": batch},
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        )
+        response.raise_for_status()
+        data = _json_loads(response.content)["data"]
+        # Results carry their input index; keep them aligned with the batch order
+        data.sort(key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    async def _arequest_embeddings(self, batch: List[str]) -> List[List[float]]:
+        return await self._post_embeddings(batch)
 
-        return embedding.data[0].embedding
+    async def submit_batch_job(self, texts: List[str], poll: bool = False):
+        """Submit texts to the OpenAI Batch API for bulk, non-interactive embedding.
+
+        Batch jobs cost half as much and have separate rate limits, but may take
+        up to 24h. Returns the batch id, or the embeddings if poll is True.
+        """
+        lines = [
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/embeddings",
+                "body": {"model": self.embeddings_model_name, "input": text},
+            })
+            for i, text in enumerate(texts)
+        ]
+        batch_file = await self.async_client.files.create(
+            file=("embeddings.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch",
+        )
+        batch = await self.async_client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h",
+        )
+
+        if poll:
+            return await self.await_batch(batch.id)
+        return batch.id
+
+    async def await_batch(self, batch_id: str, poll_interval: float = 30.0) -> List[List[float]]:
+        """Wait for a batch job to finish and return its embeddings in input order."""
+        while True:
+            batch = await self.async_client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Embedding batch {batch_id} ended with status '{batch.status}'")
+            await asyncio.sleep(poll_interval)
+
+        output = await self.async_client.files.content(batch.output_file_id)
+        embeddings = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                raise RuntimeError(f"Embedding batch {batch_id} request {record.get('custom_id')} failed")
+            embeddings[int(record["custom_id"])] = response["body"]["data"][0]["embedding"]
+
+        return [embeddings[i] for i in range(len(embeddings))]
+
+
+class _TogetherEmbedder(EmbeddingModel):
+    """Together.ai embeddings via its sync client, run in worker threads."""
+
+    # https://docs.together.ai/docs/serverless-models#embedding-models
+    # Available serverless embedding models:
+    # - BAAI/bge-base-en-v1.5 (768 dim, 512 context) - too small for 1000 token chunks
+    # - Alibaba-NLP/gte-modernbert-base (768 dim, 8192 context) - good for large chunks
+    # - intfloat/multilingual-e5-large-instruct (1024 dim, 514 context) - too small
+    # Using gte-modernbert-base for larger context window (8192 tokens)
+    provider = "together"
+    embeddings_model_name = "Alibaba-NLP/gte-modernbert-base"
+    base_url = "https://api.together.xyz/v1"
+
+    def _init_clients(self) -> None:
+        self.async_client = None  # Together.ai doesn't have async client in this version
+        self.client = _get_together_client(self.api_key)
+
+    async def _arequest_embeddings(self, batch: List[str]) -> List[List[float]]:
+        # Together.ai client is sync-only: run it in a worker thread
+        return await asyncio.to_thread(self._create_embeddings, batch)
 
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # Read provider name from stdin and create an EmbeddingModel with it
-    import sys
     # Read API key securely from stdin without echoing (for security)
     import getpass
 
@@ -4,14 +4,22 @@ Vector Database implementation using Qdrant in-memory for similarity search.
 This module provides a VectorDatabase class that uses Qdrant in-memory mode
 for efficient vector storage and similarity search operations.
 """
+import copy
+import functools
+import hashlib
+import itertools
+import time
 import uuid
-from typing import List, Tuple, Callable, Union
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Sequence, Tuple, Union
 from aimakerspace.openai_utils.embedding import EmbeddingModel
 import asyncio
 from enum import Enum
 
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+# qdrant_client pulls in grpc/protobuf and takes about a second to import,
+# so it is imported where it is used rather than when this module loads
+if TYPE_CHECKING:
+    from qdrant_client.models import Distance, FieldCondition, Filter, PayloadSchemaType, PointStruct
 
 
 class DistanceMeasure(Enum):
@@ -22,13 +30,119 @@ class DistanceMeasure(Enum):
     MANHATTAN = "manhattan"
 
 
-# Mapping from our DistanceMeasure enum to Qdrant Distance enum
-QDRANT_DISTANCE_MAP = {
-    DistanceMeasure.COSINE: Distance.COSINE,
-    DistanceMeasure.EUCLIDEAN: Distance.EUCLID,
-    DistanceMeasure.DOT_PRODUCT: Distance.DOT,
-    DistanceMeasure.MANHATTAN: Distance.MANHATTAN,
-}
+@functools.lru_cache(maxsize=1)
+def _distance_lookups():
+    """Build the DistanceMeasure -> Qdrant Distance lookups on first use.
+
+    Returns the enum mapping and a resolver that also covers the enum string
+    values and None, so resolving a distance_measure is one dict get.
+    """
+    from qdrant_client.models import Distance
+
+    distance_map = {
+        DistanceMeasure.COSINE: Distance.COSINE,
+        DistanceMeasure.EUCLIDEAN: Distance.EUCLID,
+        DistanceMeasure.DOT_PRODUCT: Distance.DOT,
+        DistanceMeasure.MANHATTAN: Distance.MANHATTAN,
+    }
+    resolve = {
+        None: Distance.COSINE,
+        **distance_map,
+        **{measure.value: distance for measure, distance in distance_map.items()},
+    }
+    return distance_map, resolve
+
+
+def _as_point_vector(vector):
+    """Prepare a vector for PointStruct without re-boxing lists.
+
+    Lists (as returned by the embedding APIs) are used as-is; arrays are
+    made contiguous float32. Vectors are stored as FP32, which matches the
+    precision of OpenAI/Together embeddings.
+    """
+    if isinstance(vector, list):
+        return vector
+    import numpy as np
+    return np.ascontiguousarray(vector, dtype=np.float32)
+
+
+def _iter_field_conditions(qdrant_filter: "Filter"):
+    """Yield every FieldCondition in a (possibly nested) Qdrant filter."""
+    from qdrant_client.models import FieldCondition, Filter
+
+    for clause in (qdrant_filter.must, qdrant_filter.should, qdrant_filter.must_not):
+        if clause is None:
+            continue
+        for condition in clause if isinstance(clause, list) else [clause]:
+            if isinstance(condition, FieldCondition):
+                yield condition
+            elif isinstance(condition, Filter):
+                yield from _iter_field_conditions(condition)
+
+
+def _payload_schema_for(condition: "FieldCondition") -> Optional["PayloadSchemaType"]:
+    """Pick the payload index type that can serve a field condition."""
+    from qdrant_client.models import MatchAny, MatchValue, PayloadSchemaType
+
+    if condition.range is not None:
+        return PayloadSchemaType.FLOAT
+    if isinstance(condition.match, MatchValue):
+        value = condition.match.value
+    elif isinstance(condition.match, MatchAny) and condition.match.any:
+        value = condition.match.any[0]
+    else:
+        return None
+    if isinstance(value, bool):
+        return PayloadSchemaType.BOOL
+    if isinstance(value, int):
+        return PayloadSchemaType.INTEGER
+    return PayloadSchemaType.KEYWORD
+
+
+class _QueryResultCache:
+    """LRU cache with a TTL for search results, with hit/miss counters."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, list]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, query_text: str, k: int, distance_measure) -> str:
+        return hashlib.sha256(f"{kind}|{query_text}|{k}|{distance_measure}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, results = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # Hand out a copy so callers can't mutate the cached results
+                return copy.deepcopy(results)
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, results: list) -> None:
+        self._entries[key] = (time.monotonic(), copy.deepcopy(results))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
 
 
 class VectorDatabase:
@@ -42,7 +156,30 @@ class VectorDatabase:
     # Default vector dimension (will be updated on first insert)
     DEFAULT_VECTOR_SIZE = 1536  # OpenAI text-embedding-3-small dimension
 
-    def __init__(self, embedding_model: EmbeddingModel = None, api_key: str = None, collection_name: str = None):
+    # Points sent per Qdrant upsert call during bulk inserts
+    UPSERT_BATCH_SIZE = 512
+
+    # Buffered single inserts are upserted once this many are pending
+    INSERT_BUFFER_SIZE = 512
+
+    # Max query embeddings kept per database
+    QUERY_EMBEDDING_CACHE_SIZE = 10_000
+
+    # Below this many vectors a brute-force scan beats walking an HNSW graph
+    BRUTE_FORCE_MAX_SIZE = 10_000
+
+    def __init__(
+        self,
+        embedding_model: EmbeddingModel = None,
+        api_key: str = None,
+        collection_name: str = None,
+        enable_quantization: bool = True,
+        location: str = ":memory:",
+        hnsw_m: int = 32,
+        hnsw_ef_construct: int = 256,
+        hnsw_ef: int = 128,
+        expected_size: Optional[int] = None,
+    ):
         """
         Initialize the VectorDatabase with Qdrant in-memory client.
 
@@ -50,9 +187,40 @@ class VectorDatabase:
             embedding_model: Optional EmbeddingModel instance for text embeddings
             api_key: Optional API key for the embedding model
             collection_name: Optional collection name (auto-generated if not provided)
+            enable_quantization: Store INT8 scalar-quantized vectors (4x less memory
+                traffic per comparison) and rescore top hits with the originals
+            location: Qdrant location; ":memory:" (default) or a server URL
+            hnsw_m: HNSW graph degree; higher gives better recall and lower query
+                latency at the cost of build time and memory
+            hnsw_ef_construct: HNSW candidate list size while building the graph
+            hnsw_ef: HNSW candidate list size while searching
+            expected_size: Expected number of vectors; below BRUTE_FORCE_MAX_SIZE
+                the graph is skipped (m=0) and searches scan all vectors
         """
-        # Initialize Qdrant client in-memory mode
-        self.client = QdrantClient(":memory:")
+        from qdrant_client import QdrantClient
+        from qdrant_client.models import HnswConfigDiff, QuantizationSearchParams, SearchParams
+
+        # Initialize Qdrant client (in-memory mode by default)
+        self.client = QdrantClient(location=location)
+        self.enable_quantization = enable_quantization
+        self._is_local = location == ":memory:"
+
+        # Small collections skip the graph entirely; a full scan is faster
+        if expected_size is not None and expected_size < self.BRUTE_FORCE_MAX_SIZE:
+            hnsw_m = 0
+        self._hnsw_config = HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+
+        # Local mode always does exact brute-force search (ignoring the HNSW
+        # config) and warns on search_params, so those only go to a server
+        self._search_params = None
+        if not self._is_local:
+            self._search_params = SearchParams(
+                hnsw_ef=hnsw_ef,
+                quantization=QuantizationSearchParams(rescore=True) if enable_quantization else None,
+            )
+
+        # Payload fields that already have a Qdrant payload index
+        self._indexed_fields = set()
 
         # Generate unique collection name if not provided
         self.collection_name = collection_name or f"collection_{uuid.uuid4().hex[:8]}"
@@ -69,70 +237,190 @@ class VectorDatabase:
         self._collection_created = False
         self._vector_size = None
 
+        # Points from insert() not yet sent to Qdrant; flushed before any read
+        self._pending_points: List["PointStruct"] = []
+
+        # Text-query result cache; cleared whenever vectors are inserted
+        self._query_cache = _QueryResultCache()
+
+        # Query-text -> float32 embedding bytes. Unlike result caching this
+        # survives inserts and different k/distance arguments, and unlike the
+        # model-level cache it is not evicted by bulk document indexing.
+        self._query_embedding_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
     def _ensure_collection(self, vector_size: int, distance_measure: DistanceMeasure = DistanceMeasure.COSINE) -> None:
         """Ensure the collection exists with the correct vector configuration."""
         if not self._collection_created:
-            qdrant_distance = QDRANT_DISTANCE_MAP.get(distance_measure, Distance.COSINE)
+            from qdrant_client.models import (
+                Distance,
+                ScalarQuantization,
+                ScalarQuantizationConfig,
+                ScalarType,
+                VectorParams,
+            )
+
+            distance_map, _ = _distance_lookups()
+            qdrant_distance = distance_map.get(distance_measure, Distance.COSINE)
+            quantization_config = None
+            if self.enable_quantization:
+                quantization_config = ScalarQuantization(
+                    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+                )
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=VectorParams(size=vector_size, distance=qdrant_distance),
+                hnsw_config=self._hnsw_config,
+                on_disk_payload=False,
+                quantization_config=quantization_config,
             )
             self._collection_created = True
             self._vector_size = vector_size
 
+    def _get_query_embedding(self, query_text: str):
+        """Embed query text, reusing cached float32 vectors for repeated queries."""
+        import numpy as np
+
+        cached = self._query_embedding_cache.get(query_text)
+        if cached is not None:
+            self._query_embedding_cache.move_to_end(query_text)
+            return np.frombuffer(cached, dtype=np.float32)
+
+        vector = np.asarray(self.embedding_model.get_embedding(query_text), dtype=np.float32)
+        self._query_embedding_cache[query_text] = vector.tobytes()
+        if len(self._query_embedding_cache) > self.QUERY_EMBEDDING_CACHE_SIZE:
+            self._query_embedding_cache.popitem(last=False)
+        return vector
+
+    def _make_point(self, key: str, vector: List[float], metadata: Optional[dict]) -> "PointStruct":
+        """Assign the next integer ID to a key and build its Qdrant point."""
+        from qdrant_client.models import PointStruct
+
+        # Lists go to Qdrant as-is; arrays are passed as contiguous float32
+        vector_list = _as_point_vector(vector)
+
+        # Ensure collection exists with correct vector size
+        self._ensure_collection(len(vector_list))
+
+        # Generate integer ID for Qdrant
+        point_id = self._next_id
+        self._next_id += 1
+
+        # Store key-ID mapping
+        self._key_to_id[key] = point_id
+        self._id_to_key[point_id] = key
+
+        # New data can change any cached ranking
+        self._query_cache.clear()
+
+        # Payload is metadata + key for retrieval
+        return PointStruct(id=point_id, vector=vector_list, payload={**(metadata or {}), '_key': key})
+
     def insert(self, key: str, vector: List[float], metadata: dict = None) -> None:
         """
         Insert a vector into the database with the given key and optional metadata.
 
+        Points are buffered and upserted INSERT_BUFFER_SIZE at a time; every
+        read flushes the buffer first, so inserts are always visible to
+        searches. Use insert_immediate to upsert right away.
+
         Args:
             key: Unique string key for the vector
             vector: Vector to insert (list of floats)
             metadata: Optional metadata dictionary to store with the vector
         """
-        # Convert to list if needed
-        vector_list = list(vector)
+        self._pending_points.append(self._make_point(key, vector, metadata))
+        if len(self._pending_points) >= self.INSERT_BUFFER_SIZE:
+            self.flush()
+
+    def insert_immediate(self, key: str, vector: List[float], metadata: dict = None) -> None:
+        """
+        Insert a vector and upsert it to Qdrant right away, bypassing the buffer.
+
+        Args:
+            key: Unique string key for the vector
+            vector: Vector to insert (list of floats)
+            metadata: Optional metadata dictionary to store with the vector
+        """
+        point = self._make_point(key, vector, metadata)
+        self.flush()
+        self.client.upsert(collection_name=self.collection_name, points=[point])
+
+    def flush(self) -> None:
+        """Upsert any buffered points to Qdrant."""
+        if not self._pending_points:
+            return
+        points = self._pending_points
+        self._pending_points = []
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def __enter__(self) -> "VectorDatabase":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def insert_many(
+        self,
+        keys: Sequence[str],
+        vectors: Sequence[List[float]],
+        metadatas: Optional[Sequence[dict]] = None,
+    ) -> None:
+        """
+        Insert many vectors with one Qdrant upsert per UPSERT_BATCH_SIZE points.
+
+        Args:
+            keys: Unique string keys, one per vector
+            vectors: Vectors to insert (lists of floats or arrays)
+            metadatas: Optional metadata dictionaries aligned with keys
+        """
+        from qdrant_client.models import PointStruct
+
+        if not keys:
+            return
+
+        # Keep upsert order: buffered single inserts go first
+        self.flush()
 
         # Ensure collection exists with correct vector size
-        self._ensure_collection(len(vector_list))
+        self._ensure_collection(len(vectors[0]))
 
-        # Generate integer ID for Qdrant
-        point_id = self._next_id
-        self._next_id += 1
+        # Reserve a contiguous block of integer IDs and record key mappings
+        point_ids = range(self._next_id, self._next_id + len(keys))
+        self._next_id += len(keys)
+        self._key_to_id.update(zip(keys, point_ids))
+        self._id_to_key.update(zip(point_ids, keys))
 
-        # Store key-ID mapping
-        self._key_to_id[key] = point_id
-        self._id_to_key[point_id] = key
+        # New data can change any cached ranking
+        self._query_cache.clear()
 
-        # Prepare payload (metadata + key for retrieval)
-        payload = metadata.copy() if metadata else {}
-        payload['_key'] = key  # Store the original key in payload
+        if metadatas is None:
+            metadatas = itertools.repeat(None)
 
-        # Insert into Qdrant
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                PointStruct(
-                    id=point_id,
-                    vector=vector_list,
-                    payload=payload
-                )
-            ]
+        points = (
+            PointStruct(
+                id=point_id,
+                vector=_as_point_vector(vector),
+                payload={**(metadata or {}), '_key': key},
+            )
+            for point_id, key, vector, metadata in zip(point_ids, keys, vectors, metadatas)
         )
+        while True:
+            chunk = list(itertools.islice(points, self.UPSERT_BATCH_SIZE))
+            if not chunk:
+                break
+            self.client.upsert(collection_name=self.collection_name, points=chunk)
 
-    def _get_qdrant_distance(self, distance_measure: Union[str, DistanceMeasure, Callable]) -> Distance:
+    def _get_qdrant_distance(self, distance_measure: Union[str, DistanceMeasure, Callable]) -> "Distance":
         """Convert distance measure to Qdrant Distance enum."""
+        _, resolve = _distance_lookups()
+        cosine = resolve[None]
+        # Custom functions (and anything unknown) default to cosine in Qdrant
         if callable(distance_measure):
-            # Custom functions default to cosine in Qdrant
-            return Distance.COSINE
-        elif isinstance(distance_measure, DistanceMeasure):
-            return QDRANT_DISTANCE_MAP.get(distance_measure, Distance.COSINE)
-        elif isinstance(distance_measure, str):
-            try:
-                enum_value = DistanceMeasure(distance_measure.lower())
-                return QDRANT_DISTANCE_MAP.get(enum_value, Distance.COSINE)
-            except ValueError:
-                return Distance.COSINE
-        return Distance.COSINE
+            return cosine
+        distance = resolve.get(distance_measure)
+        if distance is None and isinstance(distance_measure, str):
+            distance = resolve.get(distance_measure.lower())
+        return distance or cosine
 
     def search(
         self,
@@ -151,17 +439,22 @@ class VectorDatabase:
         Returns:
             List of tuples (key, similarity_score) sorted by similarity
         """
+        import numpy as np
+
         if not self._collection_created:
             return []
 
-        # Convert to list if needed
-        query_list = list(query_vector)
+        self.flush()
+
+        # Qdrant accepts ndarrays directly; float32 avoids a boxed-float list per query
+        query_list = np.ascontiguousarray(query_vector, dtype=np.float32)
 
         # Search in Qdrant using query_points (replaces deprecated search method)
         response = self.client.query_points(
             collection_name=self.collection_name,
             query=query_list,
-            limit=k
+            limit=k,
+            search_params=self._search_params,
         )
 
         # Convert results to (key, score) tuples
@@ -192,10 +485,97 @@ class VectorDatabase:
         Returns:
             List of similar vectors (as keys or tuples)
         """
-        query_vector = self.embedding_model.get_embedding(query_text)
-        results = self.search(query_vector, k, distance_measure)
+        cache_key = _QueryResultCache.make_key("search", query_text, k, distance_measure)
+        results = self._query_cache.get(cache_key)
+        if results is None:
+            query_vector = self._get_query_embedding(query_text)
+            results = self.search(query_vector, k, distance_measure)
+            self._query_cache.put(cache_key, results)
         return [result[0] for result in results] if return_as_text else results
 
+    def batch_search(
+        self,
+        query_vectors: Sequence[List[float]],
+        k: int,
+        distance_measure: Union[str, DistanceMeasure, Callable] = DistanceMeasure.COSINE,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for several query vectors in a single Qdrant round-trip.
+
+        Useful for multi-query retrieval (query rewriting, HyDE) where each
+        query would otherwise cost its own query_points call.
+
+        Args:
+            query_vectors: The query vectors to search with
+            k: Number of similar vectors to return per query
+            distance_measure: Distance measure to use (string, enum, or function)
+
+        Returns:
+            One list of (key, similarity_score) tuples per query, in input order
+        """
+        import numpy as np
+        from qdrant_client.models import QueryRequest
+
+        if not self._collection_created or not query_vectors:
+            return [[] for _ in query_vectors]
+
+        self.flush()
+
+        requests = [
+            QueryRequest(
+                query=np.ascontiguousarray(query_vector, dtype=np.float32),
+                limit=k,
+                with_payload=True,
+                params=self._search_params,
+            )
+            for query_vector in query_vectors
+        ]
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests,
+        )
+
+        return [
+            [(hit.payload.get('_key', str(hit.id)), hit.score) for hit in response.points]
+            for response in responses
+        ]
+
+    def batch_search_by_text(
+        self,
+        query_texts: Sequence[str],
+        k: int,
+        distance_measure: Union[str, DistanceMeasure, Callable] = DistanceMeasure.COSINE,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Search for several text queries, batching the cache misses.
+
+        Queries with cached results are answered from the cache; the rest
+        are embedded and sent to Qdrant together via batch_search.
+
+        Args:
+            query_texts: Texts to convert to embeddings and search with
+            k: Number of similar vectors to return per query
+            distance_measure: Distance measure to use (string, enum, or function)
+
+        Returns:
+            One list of (key, similarity_score) tuples per query, in input order
+        """
+        results = [None] * len(query_texts)
+        misses = []
+        for index, query_text in enumerate(query_texts):
+            cache_key = _QueryResultCache.make_key("search", query_text, k, distance_measure)
+            results[index] = self._query_cache.get(cache_key)
+            if results[index] is None:
+                misses.append((index, cache_key))
+
+        if misses:
+            query_vectors = [self._get_query_embedding(query_texts[index]) for index, _ in misses]
+            for (index, cache_key), hits in zip(misses, self.batch_search(query_vectors, k, distance_measure)):
+                self._query_cache.put(cache_key, hits)
+                results[index] = hits
+
+        return results
+
     def retrieve_from_key(self, key: str) -> List[float]:
         """
         Retrieve a vector by its key.
@@ -209,6 +589,8 @@ class VectorDatabase:
         if key not in self._key_to_id:
             return None
 
+        self.flush()
+
         point_id = self._key_to_id[key]
 
         try:
@@ -224,21 +606,59 @@ class VectorDatabase:
 
         return None
 
-    async def abuild_from_list(self, list_of_text: List[str]) -> "VectorDatabase":
+    async def abuild_from_list(
+        self,
+        list_of_text: List[str],
+        batch_size: int = 1000,
+        max_concurrency: int = 5,
+    ) -> "VectorDatabase":
         """
         Build the vector database from a list of text strings.
 
+        Texts are sorted by length and embedded in chunks of batch_size,
+        with at most max_concurrency chunks in flight, so similar-length
+        inputs share a request and large ingests overlap their round-trips.
+        Embeddings are held as float32 until they are upserted. Duplicate
+        texts are embedded and stored once, since they would share a key.
+
         Args:
             list_of_text: List of text strings to embed and store
+            batch_size: Number of texts per embedding call
+            max_concurrency: Maximum concurrent embedding calls
 
         Returns:
             Self for method chaining
         """
-        embeddings = await self.embedding_model.async_get_embeddings(list_of_text)
-        for text, embedding in zip(list_of_text, embeddings):
-            self.insert(text, embedding)
+        import numpy as np
+
+        # Texts are the point keys, so duplicates collapse to one point each
+        unique_texts = list(dict.fromkeys(list_of_text))
+        sorted_texts = sorted(unique_texts, key=len)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def embed_chunk(chunk: List[str]):
+            async with semaphore:
+                embeddings = await self.embedding_model.async_get_embeddings(chunk)
+            # Pack each chunk into one float32 matrix right away; its rows go
+            # to Qdrant as-is instead of as boxed float64 lists
+            return np.asarray(embeddings, dtype=np.float32)
+
+        results = await asyncio.gather(*[
+            embed_chunk(sorted_texts[i:i + batch_size])
+            for i in range(0, len(sorted_texts), batch_size)
+        ])
+
+        # Scatter embeddings back to the caller's (first-occurrence) order
+        embedding_by_text = dict(zip(sorted_texts, itertools.chain.from_iterable(results)))
+        embeddings = [embedding_by_text[text] for text in unique_texts]
+
+        self.insert_many(unique_texts, embeddings)
         return self
 
+    def get_query_cache_stats(self) -> dict:
+        """Get hit/miss counters and hit rate for the text-query result cache."""
+        return self._query_cache.stats()
+
     def get_available_distance_measures(self) -> List[str]:
         """Get a list of available distance measure names."""
         return [measure.value for measure in DistanceMeasure]
@@ -263,26 +683,36 @@ class VectorDatabase:
         if not self._collection_created:
             return []
 
-        query_vector = self.embedding_model.get_embedding(query_text)
-        query_list = list(query_vector)
+        self.flush()
+
+        cache_key = _QueryResultCache.make_key("metadata", query_text, k, distance_measure)
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # float32 ndarray straight from the cache; no per-query list conversion
+        query_list = self._get_query_embedding(query_text)
 
         # Search in Qdrant with full payload using query_points (replaces deprecated search method)
         response = self.client.query_points(
             collection_name=self.collection_name,
             query=query_list,
             limit=k,
-            with_payload=True
+            with_payload=True,
+            search_params=self._search_params,
         )
 
         # Build enriched results
         enriched_results = []
         for hit in response.points:
-            metadata = hit.payload.copy() if hit.payload else {}
-            key = metadata.pop('_key', str(hit.id))  # Remove internal key from metadata
+            payload = hit.payload or {}
+            # Build the result dict in one pass, skipping the internal key
+            metadata = {name: value for name, value in payload.items() if name != '_key'}
             metadata['similarity_score'] = hit.score
-            metadata['key'] = key
+            metadata['key'] = payload.get('_key', str(hit.id))
             enriched_results.append(metadata)
 
+        self._query_cache.put(cache_key, enriched_results)
         return enriched_results
 
     def get_metadata(self, key: str) -> dict:
@@ -298,6 +728,8 @@ class VectorDatabase:
         if key not in self._key_to_id:
             return {}
 
+        self.flush()
+
         point_id = self._key_to_id[key]
 
         try:
@@ -307,53 +739,107 @@ class VectorDatabase:
                 with_payload=True
             )
             if points:
-                metadata = points[0].payload.copy() if points[0].payload else {}
-                metadata.pop('_key', None)  # Remove internal key
-                return metadata
+                payload = points[0].payload or {}
+                return {name: value for name, value in payload.items() if name != '_key'}
         except Exception:
             pass
 
         return {}
 
-    def get_vectors_by_metadata_filter(self, filter_func: Callable) -> List[dict]:
+    def _ensure_payload_indexes(self, qdrant_filter: "Filter") -> None:
+        """Create a payload index the first time a field is used in a filter.
+
+        Local mode has no payload indexes (and warns when asked for one), so
+        this only runs against a Qdrant server.
         """
-        Get all vectors that match a metadata filter function.
+        if self._is_local:
+            return
+        for condition in _iter_field_conditions(qdrant_filter):
+            if condition.key in self._indexed_fields:
+                continue
+            field_schema = _payload_schema_for(condition)
+            if field_schema is None:
+                continue
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=condition.key,
+                field_schema=field_schema,
+            )
+            self._indexed_fields.add(condition.key)
+
+    def iter_vectors_by_metadata_filter(
+        self,
+        filter_func: Optional[Callable] = None,
+        qdrant_filter: Optional["Filter"] = None,
+        page_size: int = 10_000,
+    ) -> Iterator[dict]:
+        """
+        Yield metadata for vectors that match a metadata filter, page by page.
+
+        Prefer qdrant_filter for structured predicates: Qdrant applies it
+        server-side (using payload indexes) and only matches are returned.
+        filter_func is still applied client-side, to the filtered records
+        when both are given. Only one page of records is held at a time.
 
         Args:
-            filter_func: Function that takes metadata dict and returns bool
+            filter_func: Function that takes the stored payload dict and returns bool
+                (the payload also carries the internal '_key' entry)
+            qdrant_filter: Optional Qdrant Filter applied by the server
+            page_size: Records fetched per scroll round-trip
 
-        Returns:
-            List of metadata dictionaries for matching vectors
+        Yields:
+            Metadata dictionaries for matching vectors
         """
         if not self._collection_created:
-            return []
+            return
+
+        self.flush()
 
-        matching_vectors = []
+        if qdrant_filter is not None:
+            self._ensure_payload_indexes(qdrant_filter)
 
-        # Scroll through all points and apply filter
-        # Note: For production use with large datasets, consider using Qdrant's filter API
         offset = None
         while True:
             records, next_offset = self.client.scroll(
                 collection_name=self.collection_name,
-                limit=100,
+                scroll_filter=qdrant_filter,
+                limit=page_size,
                 offset=offset,
-                with_payload=True
+                with_payload=True,
+                with_vectors=False,
             )
 
             for record in records:
-                metadata = record.payload.copy() if record.payload else {}
-                key = metadata.pop('_key', str(record.id))
-                if filter_func(metadata):
-                    metadata['key'] = key
-                    matching_vectors.append(metadata)
+                payload = record.payload or {}
+                # Filter on the raw payload; only matches get a cleaned copy
+                if filter_func is None or filter_func(payload):
+                    metadata = {name: value for name, value in payload.items() if name != '_key'}
+                    metadata['key'] = payload.get('_key', str(record.id))
+                    yield metadata
 
             if next_offset is None:
                 break
             offset = next_offset
 
-        return matching_vectors
+    def get_vectors_by_metadata_filter(
+        self,
+        filter_func: Optional[Callable] = None,
+        qdrant_filter: Optional["Filter"] = None,
+    ) -> List[dict]:
+        """
+        Get all vectors that match a metadata filter.
+
+        See iter_vectors_by_metadata_filter, which this collects into a list.
+
+        Args:
+            filter_func: Function that takes the stored payload dict and returns bool
+                (the payload also carries the internal '_key' entry)
+            qdrant_filter: Optional Qdrant Filter applied by the server
 
+        Returns:
+            List of metadata dictionaries for matching vectors
+        """
+        return list(self.iter_vectors_by_metadata_filter(filter_func, qdrant_filter))
 
 if __name__ == "__main__":
     # Example usage demonstrating Qdrant in-memory vector database
@@ -5,19 +5,24 @@ import json
 import logging
 import os
 import re
+import secrets
 # Add current directory to Python path for Vercel deployment
 import sys
-import tempfile
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple
 
-from fastapi import (FastAPI, File, Header, HTTPException, Request,
+from fastapi import (FastAPI, File, Header, HTTPException, Query, Request,
                      UploadFile)
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-# Import OpenAI client for interacting with OpenAI's API
-from openai import OpenAI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 # Import Pydantic for data validation and settings management
 from pydantic import BaseModel, field_validator, model_validator
 # Import slowapi for rate limiting
@@ -30,24 +35,33 @@ from google.auth.transport import requests as google_requests
 import tiktoken
 from dotenv import load_dotenv
 
-logger = logging.getLogger(__name__)
+try:
+    # orjson serializes datetimes natively and is several times faster than stdlib json
+    import orjson
+except ImportError:
+    orjson = None
 
 # Load environment variables from .env file BEFORE importing modules
 # that read config via os.getenv() at module level.
 load_dotenv()
 
+# Log level comes from LOG_LEVEL (default INFO); per-request debug lines are off by default.
+# basicConfig is a no-op when the server (e.g. uvicorn) has already configured logging.
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
 # Add current directory to Python path so Vercel can find sibling modules
 # (persistence, context_manager). Must happen BEFORE importing them.
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from persistence import load_conversations, save_conversations, save_session, load_session, delete_session
+from persistence import load_conversations, save_conversations, save_session, load_session, touch_session, delete_session, trim_messages
 from context_manager import (
-    should_compress, compress_conversation, count_conversation_tokens,
+    should_compress, acompress_conversation, count_conversation_tokens,
     SUMMARY_PREFIX,
 )
-from openai_helper import create_openai_request
+from openai_helper import aclose_clients, acreate_openai_request, get_async_openai_client, get_openai_client
 
 # ============================================
 # Google OAuth Configuration
@@ -72,12 +86,34 @@ FREE_MODEL = os.getenv("FREE_MODEL", "deepseek-ai/DeepSeek-V3.1")
 # ============================================
 MAX_IMAGE_SIZE_MB = float(os.getenv("MAX_IMAGE_SIZE_MB", "3"))
 
+# ============================================
+# Request Body Limits
+# ============================================
+# JSON bodies above this size are rejected with 413 before they are read or parsed.
+# Sized for the largest valid chat request: a base64-encoded image (4/3 of
+# MAX_IMAGE_SIZE_MB) plus message text. File uploads enforce their own limits.
+MAX_JSON_BODY_BYTES = int(MAX_IMAGE_SIZE_MB * 1024 * 1024 * 4 / 3) + 256 * 1024
+
 # ============================================
 # Audio Upload Configuration
 # ============================================
 MAX_AUDIO_SIZE_MB = 25  # OpenAI Whisper's actual limit
 MAX_AUDIO_SIZE_BYTES = MAX_AUDIO_SIZE_MB * 1024 * 1024
 
+# ============================================
+# Conversation Storage Configuration
+# ============================================
+MAX_CONVERSATION_SESSIONS = int(os.getenv("MAX_CONVERSATION_SESSIONS", "10000"))
+CONVERSATION_IDLE_TTL_SECONDS = float(os.getenv("CONVERSATION_IDLE_TTL_SECONDS", "3600"))
+
+# ============================================
+# Streaming Configuration
+# ============================================
+# Chat token deltas are coalesced before being written to the client:
+# a chunk is flushed once it reaches this many characters or has waited this long.
+STREAM_FLUSH_CHARS = 256
+STREAM_FLUSH_SECONDS = 0.02
+
 # Server-side API keys (for free tier)
 SERVER_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 SERVER_TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY", "")
@@ -99,8 +135,15 @@ except ImportError:
     # RAG dependencies not available - this is OK for basic chat functionality
     pass
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close pooled provider connections held by the cached OpenAI clients
+    await aclose_clients()
+
 # Initialize FastAPI application with comprehensive OpenAPI configuration
 app = FastAPI(
+    lifespan=lifespan,
     title="OpenAI Chat API (Lightweight)",
     description="""
     A lightweight FastAPI-based backend service optimized for Vercel deployment:
@@ -170,10 +213,71 @@ app = FastAPI(
 )
 
 # Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# One explicit in-process store shared by every route. Fixed windows cost a
+# single counter increment per hit (moving windows keep a timestamp list).
+limiter = Limiter(key_func=get_remote_address, storage_uri="memory://", strategy="fixed-window")
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+class JSONBodySizeLimitMiddleware:
+    """Reject request bodies larger than max_bytes with a 413.
+
+    Runs at the ASGI layer, so an oversized body is never decoded or
+    validated. Every body except multipart uploads is checked, since FastAPI
+    parses a body without a Content-Type as JSON too; multipart uploads pass
+    through to their endpoint's own checks. Bodies sent without a
+    Content-Length (chunked) are counted as they arrive and replayed to the app.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            content_type = headers.get(b"content-type", b"").lower()
+            if not content_type.startswith(b"multipart/form-data"):
+                content_length = headers.get(b"content-length")
+                if content_length is not None:
+                    try:
+                        too_large = int(content_length) > self.max_bytes
+                    except ValueError:
+                        too_large = False  # Server already rejects malformed lengths
+                else:
+                    receive, too_large = await self._buffer_body(receive)
+                if too_large:
+                    response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+    async def _buffer_body(self, receive):
+        """Read a length-less body up to max_bytes; return a replaying receive and whether it overflowed."""
+        messages = []
+        received = 0
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                return receive, True
+            if not message.get("more_body", False):
+                break
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return replay, False
+
+
+# Registered before CORS so that CORS stays outermost and 413s carry CORS headers
+app.add_middleware(JSONBodySizeLimitMiddleware, max_bytes=MAX_JSON_BODY_BYTES)
+
 # Configure CORS (Cross-Origin Resource Sharing) middleware
 # This allows the API to be accessed from different domains/origins
 app.add_middleware(
@@ -185,9 +289,175 @@ app.add_middleware(
     expose_headers=["X-Conversation-ID", "X-Free-Turns-Remaining"],  # Expose custom headers to frontend
 )
 
+class ConversationStore(MutableMapping):
+    """Bounded in-memory mapping of session_id -> conversations.
+
+    Sessions idle for longer than ttl are dropped, and the least recently used
+    session is evicted once max_size is exceeded. Google users' conversations
+    are persisted to Redis and lazily rehydrated, so eviction only loses
+    in-memory history for sessions that have gone quiet.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _expire(self, now: float) -> None:
+        # Entries are kept in access order, so expired ones sit at the front
+        while self._entries:
+            accessed_at, _ = next(iter(self._entries.values()))
+            if now - accessed_at < self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def __getitem__(self, session_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            _, value = self._entries[session_id]
+            self._entries[session_id] = (now, value)
+            self._entries.move_to_end(session_id)
+            return value
+
+    def __setitem__(self, session_id: str, value: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._entries[session_id] = (now, value)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            del self._entries[session_id]
+
+    def __contains__(self, session_id: object) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return session_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _orjson_default(obj: Any) -> Any:
+    """Serialize Pydantic models (e.g. legacy Message objects) that orjson can't handle."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed.
+
+    Return it directly from endpoints that build plain dicts without a
+    response_model (e.g. conversation history); that skips FastAPI's
+    jsonable_encoder pass and lets orjson encode datetimes in C. Endpoints with
+    a response_model should keep the default response class, which FastAPI
+    already serializes straight to bytes via Pydantic.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONRequest(Request):
+    """Request whose JSON body is decoded with orjson instead of stdlib json."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route class that hands endpoints a FastJSONRequest, so FastAPI parses
+    JSON bodies (e.g. long chat messages) with orjson before validation."""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await original_route_handler(FastJSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
+# Must be set before any route is declared; stdlib json is kept when orjson is missing
+if orjson is not None:
+    app.router.route_class = FastJSONRoute
+
+
+async def coalesce_stream(
+    chunks: AsyncIterator[str],
+    max_chars: int = STREAM_FLUSH_CHARS,
+    max_delay: float = STREAM_FLUSH_SECONDS,
+) -> AsyncIterator[str]:
+    """Merge small streamed text deltas into fewer, larger chunks.
+
+    Providers emit deltas of a few characters each; writing them one by one
+    costs a chunked-encoding frame and a socket write per delta. Buffered text
+    is flushed once it reaches max_chars, or max_delay seconds after the first
+    buffered delta even if the provider goes quiet, so latency stays bounded.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Provider is quiet; don't hold buffered text past the deadline
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                continue
+
+            next_chunk, pending = pending, None
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= max_chars:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
 # In-memory storage for conversations (in production, use a proper database)
 # Structure: {session_id: {conversation_id: conversation_data}}
-conversations: Dict[str, Dict[str, Dict[str, Any]]] = {}
+conversations = ConversationStore(MAX_CONVERSATION_SESSIONS, CONVERSATION_IDLE_TTL_SECONDS)
 
 # Session management
 # Structure: {session_id: {
@@ -225,7 +495,8 @@ def create_session(
     Returns:
         session_id: Unique session identifier
     """
-    session_id = str(uuid.uuid4())
+    # Session IDs are bearer credentials: 128 random bits from the secrets module
+    session_id = secrets.token_hex(16)
 
     # Determine if user is whitelisted
     is_whitelisted = False
@@ -258,9 +529,11 @@ def get_session(session_id: str) -> Optional[Dict[str, Any]]:
     """Get session data for a session, return None if session doesn't exist.
 
     Checks in-memory cache first, then falls back to Redis if not found.
+    Either way the persisted copy's TTL slides forward while the session is in use.
     """
     # Check in-memory cache first
     if session_id in sessions:
+        touch_session(session_id)
         return sessions[session_id]
 
     # Fall back to Redis
@@ -377,6 +650,36 @@ def get_session_conversations(session_id: str) -> Dict[str, Dict[str, Any]]:
 
     return conversations[session_id]
 
+def get_openai_history(conv_data: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Return a conversation's messages as role/content dicts for the LLM.
+
+    The formatted history is cached on the conversation under "openai_messages"
+    and only the turns appended since the last call are formatted, so long
+    conversations aren't re-walked on every request. Anything that replaces or
+    removes messages must update the cache as well (or drop it to force a rebuild).
+    """
+    messages = conv_data["messages"]
+    history = conv_data.get("openai_messages")
+    if history is None or len(history) > len(messages):
+        history = []
+        conv_data["openai_messages"] = history
+    for msg in messages[len(history):]:
+        history.append({"role": msg["role"], "content": msg["content"]})
+    return history
+
+def cap_conversation_history(conv_data: Dict[str, Any]) -> None:
+    """Bound a conversation's in-memory messages to the persisted retention limit.
+
+    Uses the same rule as Redis persistence (newest MAX_MESSAGES_PER_CONVERSATION,
+    keeping a leading summary), so memory and GET latency stay bounded for
+    chatty conversations. The formatted history cache is dropped on trim.
+    """
+    messages = conv_data["messages"]
+    trimmed = trim_messages(messages)
+    if trimmed is not messages:
+        conv_data["messages"] = trimmed
+        conv_data.pop("openai_messages", None)
+
 # Image attachment model for chat requests
 class ImageAttachment(BaseModel):
     mime_type: str  # MIME type (e.g., "image/png", "image/jpeg")
@@ -447,6 +750,22 @@ class ImageAttachment(BaseModel):
 
         return self
 
+# Conversation IDs: alphanumerics, hyphens and underscores (compiled once, used per request)
+CONVERSATION_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+
+# Allowed model and provider selections, built once instead of per request.
+# Tuples keep the order shown in error messages; the set gives O(1) lookups.
+OPENAI_MODELS = ("gpt-5", "gpt-5-mini", "gpt-5-nano")  # GPT-5 family only
+TOGETHER_MODELS = (
+    "deepseek-ai/DeepSeek-R1", "deepseek-ai/DeepSeek-V3.1", "deepseek-ai/DeepSeek-V3",
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+    "openai/gpt-oss-20b", "openai/gpt-oss-120b", "moonshotai/Kimi-K2-Instruct-0905",
+    "Qwen/Qwen3-Next-80B-A3B-Thinking",
+)
+ALLOWED_MODELS = OPENAI_MODELS + TOGETHER_MODELS
+ALLOWED_MODEL_SET = frozenset(ALLOWED_MODELS)
+ALLOWED_PROVIDERS = ("openai", "together")
+
 # Define the data model for chat requests using Pydantic
 # This ensures incoming request data is properly validated
 class ChatRequest(BaseModel):
@@ -485,9 +804,8 @@ class ChatRequest(BaseModel):
         if not v:
             return "openai"  # Default provider
         
-        allowed_providers = ["openai", "together"]
-        if v.lower() not in allowed_providers:
-            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(allowed_providers)}')
+        if v.lower() not in ALLOWED_PROVIDERS:
+            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(ALLOWED_PROVIDERS)}')
         
         return v.lower()
     
@@ -525,23 +843,8 @@ class ChatRequest(BaseModel):
         if not v:
             return "gpt-5-mini"  # Default model
 
-        # List of allowed models for OpenAI (GPT-5 family only)
-        openai_models = [
-            "gpt-5", "gpt-5-mini", "gpt-5-nano"
-        ]
-
-        # List of allowed models for Together.ai
-        together_models = [
-            "deepseek-ai/DeepSeek-R1", "deepseek-ai/DeepSeek-V3.1", "deepseek-ai/DeepSeek-V3",
-            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
-            "openai/gpt-oss-20b", "openai/gpt-oss-120b", "moonshotai/Kimi-K2-Instruct-0905",
-            "Qwen/Qwen3-Next-80B-A3B-Thinking"
-        ]
-
-        all_models = openai_models + together_models
-
-        if v not in all_models:
-            raise ValueError(f'Invalid model: {v}. Allowed models: {", ".join(all_models)}')
+        if v not in ALLOWED_MODEL_SET:
+            raise ValueError(f'Invalid model: {v}. Allowed models: {", ".join(ALLOWED_MODELS)}')
 
         return v
     
@@ -559,7 +862,7 @@ class ChatRequest(BaseModel):
             raise ValueError('Conversation ID is too long')
 
         # Allow alphanumeric, hyphens, and underscores
-        if not re.match(r'^[A-Za-z0-9_-]+$', v):
+        if not CONVERSATION_ID_RE.fullmatch(v):
             raise ValueError('Conversation ID contains invalid characters')
 
         return v
@@ -609,12 +912,13 @@ class ChatRequest(BaseModel):
                 raise ValueError('Image attachments are only supported with OpenAI provider')
 
             # Only allow for GPT models (GPT-5 family)
-            openai_models = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
-            if self.model not in openai_models:
-                raise ValueError(f'Image attachments are only supported with OpenAI GPT models: {", ".join(openai_models)}')
+            if self.model not in OPENAI_MODELS:
+                raise ValueError(f'Image attachments are only supported with OpenAI GPT models: {", ".join(OPENAI_MODELS)}')
 
         return self
 
+# Schema of a stored chat message. The chat and RAG handlers store plain dicts
+# with these keys rather than Message instances, to avoid validation per turn.
 class Message(BaseModel):
     role: str  # "system", "user", or "assistant"
     content: str
@@ -654,9 +958,8 @@ class SessionRequest(BaseModel):
         if not v:
             return "openai"  # Default provider
 
-        allowed_providers = ["openai", "together"]
-        if v.lower() not in allowed_providers:
-            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(allowed_providers)}')
+        if v.lower() not in ALLOWED_PROVIDERS:
+            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(ALLOWED_PROVIDERS)}')
 
         return v.lower()
 
@@ -808,23 +1111,8 @@ class RAGQueryRequest(BaseModel):
         if not v:
             return "gpt-5-mini"  # Default model
 
-        # List of allowed models for OpenAI (GPT-5 family only)
-        openai_models = [
-            "gpt-5", "gpt-5-mini", "gpt-5-nano"
-        ]
-
-        # List of allowed models for Together.ai
-        together_models = [
-            "deepseek-ai/DeepSeek-R1", "deepseek-ai/DeepSeek-V3.1", "deepseek-ai/DeepSeek-V3",
-            "meta-llama/Llama-3.3-70B-Instruct-Turbo",
-            "openai/gpt-oss-20b", "openai/gpt-oss-120b", "moonshotai/Kimi-K2-Instruct-0905",
-            "Qwen/Qwen3-Next-80B-A3B-Thinking"
-        ]
-
-        all_models = openai_models + together_models
-
-        if v not in all_models:
-            raise ValueError(f'Invalid model: {v}. Allowed models: {", ".join(all_models)}')
+        if v not in ALLOWED_MODEL_SET:
+            raise ValueError(f'Invalid model: {v}. Allowed models: {", ".join(ALLOWED_MODELS)}')
 
         return v
     
@@ -835,9 +1123,8 @@ class RAGQueryRequest(BaseModel):
         if not v:
             return "openai"  # Default provider
         
-        allowed_providers = ["openai", "together"]
-        if v.lower() not in allowed_providers:
-            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(allowed_providers)}')
+        if v.lower() not in ALLOWED_PROVIDERS:
+            raise ValueError(f'Invalid provider: {v}. Allowed providers: {", ".join(ALLOWED_PROVIDERS)}')
         
         return v.lower()
 
@@ -881,7 +1168,7 @@ async def create_session_endpoint(request: Request, session_request: SessionRequ
             message=message
         )
     except Exception as e:
-        print(f"Error creating session: {str(e)}")
+        logger.error("Error creating session: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint to create a guest session
@@ -915,7 +1202,7 @@ async def create_guest_session(request: Request):
             }
         }
     except Exception as e:
-        print(f"Error creating guest session: {str(e)}")
+        logger.error("Error creating guest session: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint to authenticate with Google OAuth
@@ -1006,7 +1293,7 @@ async def google_auth(request: Request, auth_request: GoogleAuthRequest):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in Google authentication: {str(e)}")
+        logger.error("Error in Google authentication: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint to get current user info
@@ -1112,7 +1399,7 @@ def _fetch_suggestions() -> List[str]:
         # Determine which API key to use
         api_key = SERVER_TOGETHER_API_KEY or SERVER_OPENAI_API_KEY
         if not api_key:
-            print("No API key available for suggestions, using fallback")
+            logger.info("No API key available for suggestions, using fallback")
             _cached_suggestions = fallback_suggestions
             return fallback_suggestions
 
@@ -1124,8 +1411,8 @@ def _fetch_suggestions() -> List[str]:
             base_url = "https://api.openai.com/v1"
             model = "gpt-5-mini"
 
-        # Create OpenAI client
-        client = OpenAI(api_key=api_key, base_url=base_url)
+        # Reuse the cached client for this key
+        client = get_openai_client(api_key, base_url)
 
         # Generate suggestions using LLM
         response = client.chat.completions.create(
@@ -1178,7 +1465,7 @@ def _fetch_suggestions() -> List[str]:
         return suggestions
 
     except Exception as e:
-        print(f"Error fetching suggestions: {str(e)}")
+        logger.error("Error fetching suggestions: %s", e)
         # Cache and return fallback suggestions
         _cached_suggestions = fallback_suggestions
         return fallback_suggestions
@@ -1267,9 +1554,8 @@ async def text_to_speech(
                 detail="OpenAI API key not available. Audio features require an OpenAI key."
             )
 
-        # Create OpenAI client
-        from openai_helper import create_openai_client
-        client = create_openai_client(api_key, "openai")
+        # Reuse the cached client for this key
+        client = get_openai_client(api_key)
 
         # Call OpenAI TTS API
         response = client.audio.speech.create(
@@ -1283,7 +1569,6 @@ async def text_to_speech(
         audio_bytes = response.content
 
         # Return binary MP3 response
-        from fastapi.responses import Response
         return Response(content=audio_bytes, media_type="audio/mpeg")
 
     except HTTPException:
@@ -1358,9 +1643,9 @@ async def transcribe_audio(
         if len(file_bytes) == 0:
             raise HTTPException(status_code=400, detail="Audio file is empty")
 
-        # Create OpenAI client
-        from openai_helper import create_openai_client
-        client = create_openai_client(api_key, "openai")
+        # Cached async client: the upload to the transcription API is awaited
+        # instead of blocking the event loop for the whole round-trip
+        client = get_async_openai_client(api_key, None)
 
         # Call OpenAI Whisper API for transcription
         # The API expects a tuple of (filename, file_bytes, content_type)
@@ -1369,13 +1654,13 @@ async def transcribe_audio(
 
         # Try gpt-4o-transcribe first, fall back to whisper-1 if not available
         try:
-            transcription = client.audio.transcriptions.create(
+            transcription = await client.audio.transcriptions.create(
                 model="gpt-4o-transcribe",
                 file=(filename, file_bytes, audio.content_type or "audio/webm")
             )
         except Exception as model_error:
             if "model" in str(model_error).lower() or "not found" in str(model_error).lower():
-                transcription = client.audio.transcriptions.create(
+                transcription = await client.audio.transcriptions.create(
                     model="whisper-1",
                     file=(filename, file_bytes, audio.content_type or "audio/webm")
                 )
@@ -1432,32 +1717,30 @@ async def chat(
                     detail=f"Message too long for free tier ({token_count} tokens, max {MAX_FREE_MESSAGE_TOKENS}). Please provide your own API key."
                 )
 
-        # Debug logging
-        print(
-            f"[Chat Request] "
-            f"session_id={session_id[:8]}... | "
-            f"provider={provider} | "
-            f"model={chat_request.model} | "
-            f"conversation_id={chat_request.conversation_id} | "
-            f"web_search={chat_request.web_search} | "
-            f"reasoning={chat_request.reasoning} | "
-            f"include={chat_request.include} | "
-            f"image_attachment={'yes' if chat_request.image_attachment else 'no'} | "
-            f"developer_message_len={len(chat_request.developer_message)} | "
-            f"user_message_len={len(chat_request.user_message)}"
-        )
+        # Debug logging (skipped entirely unless DEBUG is enabled)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[Chat Request] session_id=%s... | provider=%s | model=%s | conversation_id=%s | "
+                "web_search=%s | reasoning=%s | include=%s | image_attachment=%s | "
+                "developer_message_len=%d | user_message_len=%d",
+                session_id[:8], provider, chat_request.model, chat_request.conversation_id,
+                chat_request.web_search, chat_request.reasoning, chat_request.include,
+                "yes" if chat_request.image_attachment else "no",
+                len(chat_request.developer_message), len(chat_request.user_message)
+            )
 
-        # Initialize OpenAI client with the resolved API key and provider
-        client_kwargs = {"api_key": api_key}
-        if provider == "together":
-            client_kwargs["base_url"] = "https://api.together.xyz/v1"
-        client = OpenAI(**client_kwargs)
+        # Cached async client for the resolved API key and provider (used for compression)
+        base_url = "https://api.together.xyz/v1" if provider == "together" else None
+        client = get_async_openai_client(api_key, base_url)
         
         # Get session-specific conversations
         user_conversations = get_session_conversations(session_id)
         
         # Generate or retrieve conversation ID
-        conversation_id = chat_request.conversation_id or str(uuid.uuid4())
+        conversation_id = chat_request.conversation_id or uuid.uuid4().hex
+        
+        # One timestamp for everything this turn records up front
+        now = datetime.now(timezone.utc)
         
         # Initialize conversation if it doesn't exist
         if conversation_id not in user_conversations:
@@ -1465,25 +1748,26 @@ async def chat(
                 "messages": [],
                 "system_message": chat_request.developer_message,
                 "title": None,  # Will be set when first user message is added
-                "created_at": datetime.now(timezone.utc),
-                "last_updated": datetime.now(timezone.utc),
+                "created_at": now,
+                "last_updated": now,
                 "mode": "regular"  # Default to regular chat mode
             }
         
         # Add user message to conversation history
-        user_message = Message(
-            role="user",
-            content=chat_request.user_message,
-            timestamp=datetime.now(timezone.utc),
-            image_attachment=chat_request.image_attachment
-        )
+        # Stored as a plain dict (same shape as Message) to skip model validation per turn
+        user_message = {
+            "role": "user",
+            "content": chat_request.user_message,
+            "timestamp": now,
+            "image_attachment": chat_request.image_attachment.model_dump() if chat_request.image_attachment else None
+        }
         user_conversations[conversation_id]["messages"].append(user_message)
-        user_conversations[conversation_id]["last_updated"] = datetime.now(timezone.utc)
+        user_conversations[conversation_id]["last_updated"] = now
         
         # Set conversation title from first user message if not already set
         if user_conversations[conversation_id]["title"] is None:
             # Use first line of the user message as title (max 50 characters)
-            first_line = chat_request.user_message.split('\n')[0].strip()
+            first_line = chat_request.user_message.partition('\n')[0].strip()
             user_conversations[conversation_id]["title"] = first_line[:50] + ("..." if len(first_line) > 50 else "")
         
         # Build the full conversation context for OpenAI
@@ -1493,38 +1777,32 @@ async def chat(
 
         # Token-aware context management: compress if approaching context window
         if should_compress(all_messages, system_msg, chat_request.model):
-            compressed = compress_conversation(
+            compressed = await acompress_conversation(
                 all_messages, client, chat_request.model, system_msg
             )
-            # Build messages_for_openai from compressed result (already dicts)
-            messages_for_openai = [{"role": "system", "content": system_msg}]
-            for m in compressed:
-                openai_role = "assistant" if m.get("role") == "assistant" else m.get("role", "user")
-                messages_for_openai.append({"role": openai_role, "content": m.get("content", "")})
-
-            # Update in-memory messages with compressed version (convert to Message objects)
-            compressed_messages = []
-            for m in compressed:
-                compressed_messages.append(Message(
-                    role=m.get("role", "user"),
-                    content=m.get("content", ""),
-                    timestamp=datetime.now(timezone.utc),
-                ))
-            conv_data["messages"] = compressed_messages
+            # Update in-memory messages with compressed version
+            conv_data["messages"] = [
+                {
+                    "role": m.get("role", "user"),
+                    "content": m.get("content", ""),
+                    "timestamp": now,
+                    "image_attachment": None
+                }
+                for m in compressed
+            ]
+            # Drop the stale history cache; get_openai_history rebuilds it in one pass
+            conv_data.pop("openai_messages", None)
+            # The current turn is the last compressed message; track it for rollback
+            user_message = conv_data["messages"][-1]
 
             # Persist compressed state for Google-authenticated users (non-blocking)
             if session.get("auth_type") == "google" and session.get("email"):
                 asyncio.get_event_loop().run_in_executor(
                     None, save_conversations, session["email"], user_conversations
                 )
-        else:
-            messages_for_openai = [{"role": "system", "content": system_msg}]
-            for msg in all_messages:
-                # Handle both Message objects and dicts (from Redis)
-                role = msg.role if hasattr(msg, "role") else msg.get("role", "user")
-                content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-                openai_role = "assistant" if role == "assistant" else role
-                messages_for_openai.append({"role": openai_role, "content": content})
+
+        # Roles are stored OpenAI-shaped, so the cached history is sent as-is
+        messages_for_openai = [{"role": "system", "content": system_msg}, *get_openai_history(conv_data)]
         
         # Create an async generator function for streaming responses
         async def generate():
@@ -1536,7 +1814,7 @@ async def chat(
 
                 # Create a streaming chat completion request using the helper
                 # This automatically enables web search for GPT-5 models via Responses API
-                stream = create_openai_request(
+                stream = await acreate_openai_request(
                     api_key=api_key,
                     provider=chat_request.provider,
                     model=chat_request.model,
@@ -1560,7 +1838,7 @@ async def chat(
                 reasoning_started = False
 
                 # Yield each chunk of the response as it becomes available
-                for chunk in stream:
+                async for chunk in stream:
                     # Some providers may send chunks without choices or content (e.g., role updates or keep-alives)
                     try:
                         if is_responses_api:
@@ -1606,13 +1884,16 @@ async def chat(
                         continue
                 
                 # Store the assistant's response in conversation history
-                assistant_message = Message(
-                    role="assistant",
-                    content=full_response,
-                    timestamp=datetime.now(timezone.utc)
-                )
-                user_conversations[conversation_id]["messages"].append(assistant_message)
-                user_conversations[conversation_id]["last_updated"] = datetime.now(timezone.utc)
+                completed_at = datetime.now(timezone.utc)
+                assistant_message = {
+                    "role": "assistant",
+                    "content": full_response,
+                    "timestamp": completed_at,
+                    "image_attachment": None
+                }
+                conv_data["messages"].append(assistant_message)
+                conv_data["last_updated"] = completed_at
+                cap_conversation_history(conv_data)
 
                 # Persist conversations for Google-authenticated users (non-blocking)
                 if session.get("auth_type") == "google" and session.get("email"):
@@ -1623,7 +1904,7 @@ async def chat(
                 # Increment free turns counter if using server API key
                 if not session.get("has_own_api_key") and not session.get("is_whitelisted"):
                     session["free_turns_used"] += 1
-                    print(f"Free turn used: {session['free_turns_used']}/{MAX_FREE_TURNS} for session {session_id[:8]}...")
+                    logger.info("Free turn used: %d/%d for session %s...", session["free_turns_used"], MAX_FREE_TURNS, session_id[:8])
                     # Persist updated session to Redis (best-effort)
                     try:
                         save_session(session_id, session)
@@ -1631,9 +1912,15 @@ async def chat(
                         pass
 
             except Exception as e:
-                # Remove the user message if the API call failed
-                if user_conversations[conversation_id]["messages"]:
-                    user_conversations[conversation_id]["messages"].pop()
+                # Remove this turn's user message if the API call failed. Other
+                # requests on the same conversation may have appended since, so
+                # match by identity rather than popping the tail.
+                messages = conv_data["messages"]
+                for i in range(len(messages) - 1, -1, -1):
+                    if messages[i] is user_message:
+                        del messages[i]
+                        conv_data.pop("openai_messages", None)
+                        break
                 raise e
 
         # Calculate free turns remaining before creating response
@@ -1643,14 +1930,14 @@ async def chat(
             free_turns_remaining = max(0, MAX_FREE_TURNS - session["free_turns_used"])
 
         # Return a streaming response to the client with conversation ID in headers
-        response = StreamingResponse(generate(), media_type="text/plain")
+        response = StreamingResponse(coalesce_stream(generate()), media_type="text/plain")
         response.headers["X-Conversation-ID"] = conversation_id
         response.headers["X-Free-Turns-Remaining"] = str(free_turns_remaining)
         return response
     
     except Exception as e:
         # Handle any errors that occur during processing
-        print(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint to get conversation history
@@ -1658,7 +1945,7 @@ async def chat(
     "/api/conversations/{conversation_id}",
     tags=["Chat"],
     summary="Get conversation history",
-    description="Retrieve the complete history of a specific conversation including all messages and metadata.",
+    description="Retrieve the history of a specific conversation including messages and metadata. Use `limit` and `before` to page backwards through long histories; conversations keep at most the newest MAX_MESSAGES_PER_CONVERSATION messages.",
     responses={
         200: {"description": "Conversation history retrieved successfully"},
         401: {"description": "Invalid or expired session"},
@@ -1670,7 +1957,9 @@ async def chat(
 async def get_conversation(
     request: Request, 
     conversation_id: str,
-    x_session_id: str = Header(..., alias="X-Session-ID", description="Session ID for authentication")
+    x_session_id: str = Header(..., alias="X-Session-ID", description="Session ID for authentication"),
+    limit: Optional[int] = Query(None, ge=1, description="Return at most this many messages (the newest ones)"),
+    before: Optional[int] = Query(None, ge=0, description="Only return messages with an index below this one")
 ):
     # Use session ID from header parameter
     session_id = x_session_id
@@ -1685,15 +1974,21 @@ async def get_conversation(
     if conversation_id not in user_conversations:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    return {
+    # Page backwards through history: messages[before - limit:before]
+    messages = user_conversations[conversation_id]["messages"]
+    end = len(messages) if before is None else min(before, len(messages))
+    start = 0 if limit is None else max(0, end - limit)
+    
+    return FastJSONResponse({
         "conversation_id": conversation_id,
         "title": user_conversations[conversation_id].get("title", "New Conversation"),
         "system_message": user_conversations[conversation_id]["system_message"],
-        "messages": user_conversations[conversation_id]["messages"],
+        "messages": messages[start:end],
+        "total_messages": len(messages),
         "created_at": user_conversations[conversation_id]["created_at"],
         "last_updated": user_conversations[conversation_id]["last_updated"],
         "mode": user_conversations[conversation_id].get("mode", "regular")
-    }
+    })
 
 # Endpoint to list all conversations
 @app.get(
@@ -1736,7 +2031,7 @@ async def list_conversations(
     
     # Sort by last updated (most recent first)
     conversation_list.sort(key=lambda x: x["last_updated"], reverse=True)
-    return conversation_list
+    return FastJSONResponse(conversation_list)
 
 # Endpoint to delete a conversation
 @app.delete(
@@ -1779,7 +2074,7 @@ async def delete_conversation(
             None, save_conversations, session["email"], user_conversations
         )
 
-    return {"message": "Conversation deleted successfully"}
+    return FastJSONResponse({"message": "Conversation deleted successfully"})
 
 # Endpoint to clear all conversations for a specific user
 @app.delete(
@@ -1816,7 +2111,70 @@ async def clear_all_conversations(
             None, save_conversations, session["email"], user_conversations
         )
 
-    return {"message": "All conversations cleared successfully"}
+    return FastJSONResponse({"message": "All conversations cleared successfully"})
+
+DEFAULT_SUGGESTED_QUESTIONS = [
+    "What are the main topics covered in this document?",
+    "Can you explain the key concepts mentioned?",
+    "What are the important details I should know?",
+    "How does this content relate to practical applications?",
+    "What questions do you have about this material?"
+]
+
+
+async def generate_document_summary(chunks: List[str], api_key: str, provider: str) -> Tuple[str, List[str]]:
+    """Summarize an uploaded document and suggest 5 short starter questions.
+
+    Never raises: falls back to a canned message and DEFAULT_SUGGESTED_QUESTIONS.
+    """
+    try:
+        # Prepare document content for summarization
+        document_content = "\n\n".join(chunks)
+        
+        # System message for summarization
+        system_message = """
+        You are a helpful assistant. Please, summarize this document content and return 5 suggested short, punchy prompts/questions about it (under 6 words each).
+        These questions will be presented to the user so it can start a conversation with you about.
+
+        Aways respond with a JSON object in the following strict format:
+        {
+            "summary": "Brief summary of the document content",
+            "suggested_questions": ["Short Q1", "Short Q2", "Short Q3", "Short Q4", "Short Q5"]
+        }"""
+
+        # Create the prompt for summarization
+        user_message = f"Please summarize the following document content and provide 5 VERY SHORT suggested questions:\n\n{document_content}"
+        
+        # Generate summary and suggested questions without blocking the event loop
+        chat_model = ChatOpenAI(api_key=api_key, provider=provider)
+        response = await chat_model.arun(
+            model_name="gpt-5-mini" if provider == "openai" else "deepseek-ai/DeepSeek-V3.1",
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message}
+            ],
+            response_format={"type": "json_object"}
+        )
+        
+        # Parse the JSON response to extract summary and questions
+        try:
+            parsed_response = json.loads(response)
+        except json.JSONDecodeError:
+            # If JSON parsing fails, use the raw response as summary
+            return response, list(DEFAULT_SUGGESTED_QUESTIONS)
+
+        summary = parsed_response.get("summary", "Summary not available")
+        suggested_questions = parsed_response.get("suggested_questions", [])
+        
+        # Ensure we have exactly 5 questions, padding with generic ones
+        if len(suggested_questions) < 5:
+            suggested_questions = suggested_questions + DEFAULT_SUGGESTED_QUESTIONS[len(suggested_questions):]
+        return summary, suggested_questions[:5]
+        
+    except Exception as e:
+        logger.error("Error generating document summary: %s", e)
+        # Continue without summary if generation fails
+        return "Summary generation failed due to an error.", list(DEFAULT_SUGGESTED_QUESTIONS)
 
 # Document Upload endpoint
 @app.post(
@@ -1881,129 +2239,48 @@ async def upload_document(
         if len(file_content) > 20 * 1024 * 1024:  # 20MB
             raise HTTPException(status_code=400, detail="File size too large (max 20MB)")
         
-        # Create temporary file with appropriate extension
-        temp_suffix = f'.{file_extension}'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=temp_suffix) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
+        # Process the upload straight from memory; no temp-file write and re-read.
+        # Extraction and tokenization are CPU-bound, so run them off the event loop.
+        document_processor = DocumentProcessor()
+        processed_data = await asyncio.get_event_loop().run_in_executor(
+            None, document_processor.process_document_bytes, file_content, file.filename
+        )
+        
+        # Generate document ID
+        # document_id = str(uuid.uuid4())
+        document_id = file.filename
+        
+        # Get or create RAG system for this session with the specified provider
+        rag_system = get_or_create_rag_system(session_id, api_key, provider)
         
+        # Index the document and generate its summary concurrently: embedding
+        # and chat completion are independent provider round-trips
+        summary_task = asyncio.create_task(
+            generate_document_summary(processed_data["chunks"], api_key, provider)
+        )
         try:
-            # Process document using DocumentProcessor
-            document_processor = DocumentProcessor()
-            processed_data = document_processor.process_document(temp_file_path)
-            
-            # Generate document ID
-            # document_id = str(uuid.uuid4())
-            document_id = file.filename
-            
-            # Get or create RAG system for this session with the specified provider
-            rag_system = get_or_create_rag_system(session_id, api_key, provider)
-            
-            # Index the document
             await rag_system.index_document(
                 document_id=document_id,
                 chunks=processed_data["chunks"],
                 metadata=processed_data["metadata"]
             )
-            
-            # Generate document summary and suggested questions using ChatOpenAI
-            summary = None
-            suggested_questions = None
-            
-            try:
-                # Prepare document content for summarization
-                document_content = "\n\n".join(processed_data["chunks"])
-                
-                # System message for summarization
-                system_message = """
-                You are a helpful assistant. Please, summarize this document content and return 5 suggested short, punchy prompts/questions about it (under 6 words each).
-                These questions will be presented to the user so it can start a conversation with you about.
-
-                Aways respond with a JSON object in the following strict format:
-                {
-                    "summary": "Brief summary of the document content",
-                    "suggested_questions": ["Short Q1", "Short Q2", "Short Q3", "Short Q4", "Short Q5"]
-                }"""
-
-                # Create the prompt for summarization
-                user_message = f"Please summarize the following document content and provide 5 VERY SHORT suggested questions:\n\n{document_content}"
-                
-                # Generate summary and suggested questions
-                # Initialize ChatOpenAI with the provided API key and provider
-                kwargs = {}
-                kwargs["response_format"] = {"type": "json_object"}
-                chat_model = ChatOpenAI(api_key=api_key, provider=provider)
-                response = chat_model.run(
-                    model_name="gpt-5-mini" if provider == "openai" else "deepseek-ai/DeepSeek-V3.1",
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message}
-                    ],
-                    **kwargs
-                )
-                
-                # Parse the JSON response to extract summary and questions
-                try:
-                    import json
-                    parsed_response = json.loads(response)
-                    summary = parsed_response.get("summary", "Summary not available")
-                    suggested_questions = parsed_response.get("suggested_questions", [])
-                    
-                    # Ensure we have exactly 5 questions
-                    if len(suggested_questions) < 5:
-                        # Add generic questions if we don't have enough
-                        generic_questions = [
-                            "What are the main topics covered in this document?",
-                            "Can you explain the key concepts mentioned?",
-                            "What are the important details I should know?",
-                            "How does this content relate to practical applications?",
-                            "What questions do you have about this material?"
-                        ]
-                        while len(suggested_questions) < 5:
-                            suggested_questions.append(generic_questions[len(suggested_questions)])
-                    elif len(suggested_questions) > 5:
-                        # Trim to 5 questions if we have too many
-                        suggested_questions = suggested_questions[:5]
-                        
-                except json.JSONDecodeError:
-                    # If JSON parsing fails, use the raw response as summary
-                    summary = response
-                    suggested_questions = [
-                        "What are the main topics covered in this document?",
-                        "Can you explain the key concepts mentioned?",
-                        "What are the important details I should know?",
-                        "How does this content relate to practical applications?",
-                        "What questions do you have about this material?"
-                    ]
-                
-            except Exception as e:
-                print(f"Error generating document summary: {str(e)}")
-                # Continue without summary if generation fails
-                summary = "Summary generation failed due to an error."
-                suggested_questions = [
-                    "What are the main topics covered in this document?",
-                    "Can you explain the key concepts mentioned?",
-                    "What are the important details I should know?",
-                    "How does this content relate to practical applications?",
-                    "What questions do you have about this material?"
-                ]
-            
-            return DocumentUploadResponse(
-                document_id=document_id,
-                message=f"{processed_data['metadata']['file_type'].upper()} document processed and indexed successfully",
-                chunk_count=processed_data["chunk_count"],
-                file_name=document_id, #processed_data["metadata"]["file_name"],
-                file_type=processed_data["metadata"]["file_type"],
-                summary=summary,
-                suggested_questions=suggested_questions
-            )
-            
-        finally:
-            # Clean up temporary file
-            os.unlink(temp_file_path)
+        except BaseException:
+            summary_task.cancel()
+            raise
+        summary, suggested_questions = await summary_task
+        
+        return DocumentUploadResponse(
+            document_id=document_id,
+            message=f"{processed_data['metadata']['file_type'].upper()} document processed and indexed successfully",
+            chunk_count=processed_data["chunk_count"],
+            file_name=document_id, #processed_data["metadata"]["file_name"],
+            file_type=processed_data["metadata"]["file_type"],
+            summary=summary,
+            suggested_questions=suggested_questions
+        )
     
     except Exception as e:
-        print(f"Error in document upload: {str(e)}")
+        logger.error("Error in document upload: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # RAG Query endpoint
@@ -2060,28 +2337,34 @@ async def rag_query(
                     detail=f"Message too long for free tier ({token_count} tokens, max {MAX_FREE_MESSAGE_TOKENS}). Please provide your own API key."
                 )
 
-        # Debug logging
-        print(f"Received RAG query request: session_id={session_id[:8]}..., provider={provider}, model={query_request.model}, question_length={len(query_request.question)}")
+        # Debug logging (lazy %-formatting: nothing is built unless DEBUG is on)
+        logger.debug(
+            "Received RAG query request: session_id=%s..., provider=%s, model=%s, question_length=%d",
+            session_id[:8], provider, query_request.model, len(query_request.question)
+        )
         
         # Get RAG system for this session with the resolved provider
         rag_system = get_or_create_rag_system(session_id, api_key, provider)
         
+        # Retrieve chunks once; they feed both the answer and the reported count
+        relevant_chunks = rag_system.search_relevant_chunks(query_request.question, k=query_request.k)
+        relevant_chunks_count = len(relevant_chunks)
+        
         # Query the RAG system with the specified mode and developer message
         system_msg = query_request.developer_message
-        answer = rag_system.query(query_request.question, k=query_request.k, mode=query_request.mode, model_name=query_request.model, system_message=system_msg)
+        answer = rag_system.query(query_request.question, k=query_request.k, mode=query_request.mode, model_name=query_request.model, system_message=system_msg, relevant_chunks=relevant_chunks)
         
         # Get document info
         doc_info = rag_system.get_document_info()
         
-        # Get relevant chunks count (approximate)
-        relevant_chunks = rag_system.search_relevant_chunks(query_request.question, k=query_request.k)
-        relevant_chunks_count = len(relevant_chunks)
-        
         # Store the RAG conversation in session-scoped conversation history
         user_conversations = get_session_conversations(session_id)
         
         # Generate or retrieve conversation ID from header parameter
-        conversation_id = x_conversation_id or str(uuid.uuid4())
+        conversation_id = x_conversation_id or uuid.uuid4().hex
+        
+        # One timestamp for everything this query records
+        now = datetime.now(timezone.utc)
         
         # Initialize conversation if it doesn't exist
         if conversation_id not in user_conversations:
@@ -2089,34 +2372,37 @@ async def rag_query(
                 "messages": [],
                 "system_message": system_msg,
                 "title": None,  # Will be set when first user message is added
-                "created_at": datetime.now(timezone.utc),
-                "last_updated": datetime.now(timezone.utc),
+                "created_at": now,
+                "last_updated": now,
                 "mode": query_request.mode or "rag"  # RAG mode for document queries
             }
         
         # Add user message to conversation history
-        user_message = Message(
-            role="user",
-            content=query_request.question,
-            timestamp=datetime.now(timezone.utc)
-        )
+        user_message = {
+            "role": "user",
+            "content": query_request.question,
+            "timestamp": now,
+            "image_attachment": None
+        }
         user_conversations[conversation_id]["messages"].append(user_message)
-        user_conversations[conversation_id]["last_updated"] = datetime.now(timezone.utc)
+        user_conversations[conversation_id]["last_updated"] = now
         
         # Set conversation title from first user message if not already set
         if user_conversations[conversation_id]["title"] is None:
             # Use first line of the user message as title (max 50 characters)
-            first_line = query_request.question.split('\n')[0].strip()
+            first_line = query_request.question.partition('\n')[0].strip()
             user_conversations[conversation_id]["title"] = first_line[:50] + ("..." if len(first_line) > 50 else "")
         
         # Add assistant message to conversation history
-        assistant_message = Message(
-            role="assistant",
-            content=answer,
-            timestamp=datetime.now(timezone.utc)
-        )
+        assistant_message = {
+            "role": "assistant",
+            "content": answer,
+            "timestamp": now,
+            "image_attachment": None
+        }
         user_conversations[conversation_id]["messages"].append(assistant_message)
-        user_conversations[conversation_id]["last_updated"] = datetime.now(timezone.utc)
+        user_conversations[conversation_id]["last_updated"] = now
+        cap_conversation_history(user_conversations[conversation_id])
 
         # Persist conversations for Google-authenticated users (non-blocking)
         if session.get("auth_type") == "google" and session.get("email"):
@@ -2127,7 +2413,7 @@ async def rag_query(
         # Increment free turns counter if using server API key
         if not session.get("has_own_api_key") and not session.get("is_whitelisted"):
             session["free_turns_used"] += 1
-            print(f"Free turn used (RAG): {session['free_turns_used']}/{MAX_FREE_TURNS} for session {session_id[:8]}...")
+            logger.info("Free turn used (RAG): %d/%d for session %s...", session["free_turns_used"], MAX_FREE_TURNS, session_id[:8])
             # Persist updated session to Redis (best-effort)
             try:
                 save_session(session_id, session)
@@ -2158,7 +2444,7 @@ async def rag_query(
         )
     
     except Exception as e:
-        print(f"Error in RAG query: {str(e)}")
+        logger.error("Error in RAG query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get document info endpoint
@@ -2209,10 +2495,10 @@ async def get_documents(
         # Get document info
         doc_info = rag_system.get_document_info()
         
-        return doc_info
+        return FastJSONResponse(doc_info)
     
     except Exception as e:
-        print(f"Error getting documents: {str(e)}")
+        logger.error("Error getting documents: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # Define a health check endpoint to verify API status
@@ -2226,11 +2512,14 @@ async def get_documents(
     }
 )
 async def health_check():
-    return {"status": "ok"}
+    return FastJSONResponse({"status": "ok"})
 
 # Entry point for running the application directly
 if __name__ == "__main__":
     import uvicorn
 
-    # Start the server on all network interfaces (0.0.0.0) on port 8000
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Start the server on all network interfaces (0.0.0.0) on port 8000.
+    # "auto" selects uvloop and the httptools parser when they are installed and
+    # falls back to asyncio/h11 otherwise. Stay on one worker: sessions and
+    # conversations live in process memory and would not be shared across workers.
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="auto", workers=1)
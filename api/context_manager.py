@@ -5,10 +5,13 @@ Provides token-aware conversation compression (summarizing older messages when
 approaching the LLM context window) and message trimming for Redis persistence.
 """
 
+import logging
 import os
 import tiktoken
 from typing import Any, Dict, List, Optional
 
+logger = logging.getLogger(__name__)
+
 # ============================================
 # Model Context Window Sizes (tokens)
 # ============================================
@@ -106,6 +109,61 @@ def should_compress(
     return total_tokens > threshold
 
 
+def _summarization_messages(conversation_text: str) -> List[Dict[str, str]]:
+    """Build the summarizer prompt for a transcript of older messages."""
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are a conversation summarizer. Condense the following "
+                "conversation into a brief summary that preserves all key facts, "
+                "decisions, names, numbers, and context needed to continue the "
+                "conversation coherently. Be concise but comprehensive. "
+                "Output ONLY the summary, no preamble."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Summarize this conversation:\n\n{conversation_text}",
+        },
+    ]
+
+
+def _split_for_compression(messages: List[Any], keep_recent: int):
+    """Split messages into (to_summarize, to_keep, transcript of to_summarize)."""
+    to_summarize = messages[:-keep_recent]
+    to_keep = messages[-keep_recent:]
+
+    # Build the text to summarize
+    summary_lines = []
+    for msg in to_summarize:
+        role = msg.role if hasattr(msg, "role") else msg.get("role", "unknown")
+        content = msg.content if hasattr(msg, "content") else msg.get("content", "")
+        # If this is already a summary, include it as context
+        if content.startswith(SUMMARY_PREFIX):
+            summary_lines.append(f"Previous summary: {content[len(SUMMARY_PREFIX):]}")
+        else:
+            summary_lines.append(f"{role}: {content}")
+
+    return to_summarize, to_keep, "\n".join(summary_lines)
+
+
+def _with_summary(summary_text: str, summarized_count: int, to_keep: List[Any], model: str) -> List[Dict[str, Any]]:
+    """Prepend the summary message (as a dict) to the preserved recent messages."""
+    summary_msg = {
+        "role": "system",
+        "content": f"{SUMMARY_PREFIX} {summary_text}",
+    }
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Compressed %d messages into summary (%d tokens)",
+            summarized_count, _count_tokens(summary_text, model),
+        )
+
+    return [summary_msg] + [_to_dict(m) for m in to_keep]
+
+
 def compress_conversation(
     messages: List[Any],
     client,
@@ -133,73 +191,57 @@ def compress_conversation(
         # Not enough messages to compress — normalize to dicts for consistent return type
         return [_to_dict(m) for m in messages]
 
-    # Split: messages to summarize vs. messages to keep
-    to_summarize = messages[:-keep_recent]
-    to_keep = messages[-keep_recent:]
-
-    # Build the text to summarize
-    summary_lines = []
-    for msg in to_summarize:
-        role = msg.role if hasattr(msg, "role") else msg.get("role", "unknown")
-        content = msg.content if hasattr(msg, "content") else msg.get("content", "")
-        # If this is already a summary, include it as context
-        if content.startswith(SUMMARY_PREFIX):
-            summary_lines.append(f"Previous summary: {content[len(SUMMARY_PREFIX):]}")
-        else:
-            summary_lines.append(f"{role}: {content}")
-
-    conversation_text = "\n".join(summary_lines)
+    to_summarize, to_keep, conversation_text = _split_for_compression(messages, keep_recent)
 
     try:
         summary_response = client.chat.completions.create(
             model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a conversation summarizer. Condense the following "
-                        "conversation into a brief summary that preserves all key facts, "
-                        "decisions, names, numbers, and context needed to continue the "
-                        "conversation coherently. Be concise but comprehensive. "
-                        "Output ONLY the summary, no preamble."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": f"Summarize this conversation:\n\n{conversation_text}",
-                },
-            ],
+            messages=_summarization_messages(conversation_text),
             max_tokens=1000,
             stream=False,
         )
-
         summary_text = summary_response.choices[0].message.content.strip()
+        return _with_summary(summary_text, len(to_summarize), to_keep, model)
 
-        # Create the summary as a dict (will be converted to Message by caller)
-        summary_msg = {
-            "role": "system",
-            "content": f"{SUMMARY_PREFIX} {summary_text}",
-        }
+    except Exception as e:
+        logger.warning("Conversation compression failed, using recent messages only: %s", e)
+        # Fallback: just return recent messages (no summary)
+        return [_to_dict(m) for m in to_keep]
 
-        print(
-            f"Compressed {len(to_summarize)} messages into summary "
-            f"({_count_tokens(summary_text, model)} tokens)"
-        )
 
-        return [summary_msg] + [
-            {"role": (m.role if hasattr(m, "role") else m.get("role", "user")),
-             "content": (m.content if hasattr(m, "content") else m.get("content", ""))}
-            for m in to_keep
-        ]
+async def acompress_conversation(
+    messages: List[Any],
+    client,
+    model: str,
+    system_message: str,
+    keep_recent: int = None,
+) -> List[Dict[str, Any]]:
+    """Async version of compress_conversation for an AsyncOpenAI client.
+
+    Same splitting, prompt and fallback behavior, but awaits the summary request
+    so a request handler doesn't block the event loop while it runs.
+    """
+    if keep_recent is None:
+        keep_recent = KEEP_RECENT_MESSAGES
+
+    if len(messages) <= keep_recent + 1:
+        return [_to_dict(m) for m in messages]
+
+    to_summarize, to_keep, conversation_text = _split_for_compression(messages, keep_recent)
+
+    try:
+        summary_response = await client.chat.completions.create(
+            model=model,
+            messages=_summarization_messages(conversation_text),
+            max_tokens=1000,
+            stream=False,
+        )
+        summary_text = summary_response.choices[0].message.content.strip()
+        return _with_summary(summary_text, len(to_summarize), to_keep, model)
 
     except Exception as e:
-        print(f"Conversation compression failed, using recent messages only: {e}")
-        # Fallback: just return recent messages (no summary)
-        return [
-            {"role": (m.role if hasattr(m, "role") else m.get("role", "user")),
-             "content": (m.content if hasattr(m, "content") else m.get("content", ""))}
-            for m in to_keep
-        ]
+        logger.warning("Conversation compression failed, using recent messages only: %s", e)
+        return [_to_dict(m) for m in to_keep]
 
 
 def trim_messages_for_persistence(
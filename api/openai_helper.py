@@ -8,14 +8,213 @@ Provides a unified interface for OpenAI requests that:
 - Normalizes output for different use cases
 """
 
-from openai import OpenAI
-from typing import List, Dict, Any, Optional, Iterator, Union
+import asyncio
+import functools
+import hashlib
+import random
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+    RateLimitError,
+)
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
 
 
 # GPT-5 models that support web search via Responses API
 GPT5_WEB_SEARCH_MODELS = ["gpt-5", "gpt-5-mini", "gpt-5-nano"]
 
 
+# Connection pool sizing for provider clients. httpx defaults (100 connections,
+# 20 keep-alive) queue concurrent embedding batches and surface PoolTimeout.
+# These are httpx 0.x objects handed to the SDK's client, so openai stays
+# pinned below 3.x (which moved to the incompatible httpx2 package).
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=200, keepalive_expiry=30)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# HTTP/2 lets concurrent requests multiplex over one connection; it needs the
+# optional h2 package (installed via httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+
+def create_http_client() -> httpx.Client:
+    """Create a sync httpx client with tuned pool limits for OpenAI-compatible APIs."""
+    return DefaultHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT, http2=HTTP2_ENABLED)
+
+
+def create_async_http_client() -> httpx.AsyncClient:
+    """Create an async httpx client with tuned pool limits for OpenAI-compatible APIs."""
+    return DefaultAsyncHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT, http2=HTTP2_ENABLED)
+
+
+@functools.lru_cache(maxsize=1)
+def get_shared_http_client() -> httpx.Client:
+    """Process-wide sync httpx client shared by every cached SDK client."""
+    return create_http_client()
+
+
+# Per-loop async HTTP pools: pooled connections are bound to the event loop
+# that opened them, so each loop (e.g. successive asyncio.run calls) gets its own
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_shared_async_http_client() -> httpx.AsyncClient:
+    """Async httpx client shared by every cached SDK client on the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = _async_http_clients[loop] = create_async_http_client()
+    return client
+
+
+# Upper bound on cached SDK clients; one entry per distinct (API key, base URL)
+MAX_CACHED_CLIENTS = 512
+
+
+def _hash_api_key(api_key: str) -> str:
+    """Hash an API key so raw keys are never held as cache keys.
+
+    Runs on every chat request, so it uses BLAKE2b with a 16-byte digest,
+    which is cheaper than SHA-256 and plenty for dict keying.
+    """
+    return hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+
+
+class _ClientCache:
+    """Thread-safe LRU of SDK clients keyed by (hashed API key, base URL)."""
+
+    def __init__(self, factory: Callable[[str, Optional[str]], Any], maxsize: int = MAX_CACHED_CLIENTS):
+        self._factory = factory
+        self._maxsize = maxsize
+        self._clients: "OrderedDict[Tuple[str, Optional[str]], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> Any:
+        key = (_hash_api_key(api_key), base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            client = self._factory(api_key, base_url)
+            self._clients[key] = client
+            if len(self._clients) > self._maxsize:
+                self._clients.popitem(last=False)
+            return client
+
+    def keys(self) -> List[Tuple[str, Optional[str]]]:
+        with self._lock:
+            return list(self._clients)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
+
+
+_sync_clients = _ClientCache(
+    lambda api_key, base_url: OpenAI(api_key=api_key, base_url=base_url, http_client=get_shared_http_client())
+)
+# Per-loop async SDK clients, each built on its loop's shared HTTP pool
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ClientCache]" = weakref.WeakKeyDictionary()
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """Get a cached sync client for (api_key, base_url), built on the shared HTTP pool."""
+    return _sync_clients.get(api_key, base_url)
+
+
+def get_async_openai_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """Get a cached async client for (api_key, base_url) on the running event loop's HTTP pool.
+
+    Must be called from a coroutine; clients are loop-bound, so callers that
+    outlive one loop should resolve the client per call rather than store it.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = _ClientCache(
+            lambda key, url: AsyncOpenAI(api_key=key, base_url=url, http_client=get_shared_async_http_client())
+        )
+    return clients.get(api_key, base_url)
+
+
+async def aclose_clients() -> None:
+    """Drop cached SDK clients and close the shared HTTP pools (call on app shutdown).
+
+    Async clients and their pool are closed for the running event loop only.
+    """
+    _sync_clients.clear()
+    loop = asyncio.get_running_loop()
+    _async_clients.pop(loop, None)
+    async_http_client = _async_http_clients.pop(loop, None)
+    if async_http_client is not None:
+        await async_http_client.aclose()
+    if get_shared_http_client.cache_info().currsize:
+        get_shared_http_client().close()
+        get_shared_http_client.cache_clear()
+
+
+# Retry policy for transient provider failures (429s, 5xx, timeouts)
+MAX_RETRIES = 5
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Check whether an SDK or raw httpx error is worth retrying."""
+    if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, httpx.TimeoutException)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Exponential backoff with jitter, honoring a Retry-After header when present."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_DELAY_SECONDS)
+        except ValueError:
+            pass
+    return min(2 ** attempt + random.random(), MAX_RETRY_DELAY_SECONDS)
+
+
+async def with_retries(fn: Callable[[], Awaitable[T]], max_retries: int = MAX_RETRIES) -> T:
+    """Await fn(), retrying transient provider errors with backoff and jitter.
+
+    Each call retries independently, so one throttled request inside an
+    asyncio.gather does not abort its already-completed siblings.
+    """
+    for attempt in range(max_retries):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == max_retries - 1 or not _is_retryable(e):
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
 def _supports_web_search(provider: str, model: str) -> bool:
     """Check if the model supports web search."""
     return provider == "openai" and model in GPT5_WEB_SEARCH_MODELS
@@ -23,7 +222,7 @@ def _supports_web_search(provider: str, model: str) -> bool:
 
 def create_openai_client(api_key: str, provider: str) -> OpenAI:
     """
-    Create an OpenAI client with appropriate configuration.
+    Get the cached OpenAI client configured for the provider.
 
     Args:
         api_key: API key for the provider
@@ -32,11 +231,8 @@ def create_openai_client(api_key: str, provider: str) -> OpenAI:
     Returns:
         Configured OpenAI client
     """
-    client_kwargs = {"api_key": api_key}
-    if provider == "together":
-        client_kwargs["base_url"] = "https://api.together.xyz/v1"
-
-    return OpenAI(**client_kwargs)
+    base_url = "https://api.together.xyz/v1" if provider == "together" else None
+    return get_openai_client(api_key, base_url)
 
 
 def _messages_to_responses_input(messages: List[Dict[str, str]], image_data_url: Optional[str] = None) -> Union[str, List[Dict[str, Any]]]:
@@ -88,6 +284,55 @@ def _messages_to_responses_input(messages: List[Dict[str, str]], image_data_url:
     ]
 
 
+def _build_request_params(
+    provider: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    stream: bool,
+    image_data_url: Optional[str],
+    web_search: Optional[bool],
+    reasoning: Optional[Dict[str, str]],
+    include: Optional[List[str]],
+    **kwargs
+) -> Dict[str, Any]:
+    """Build request parameters for the Responses API (GPT-5) or Chat Completions API."""
+    # For OpenAI GPT-5 models, use Responses API with web search tool
+    if _supports_web_search(provider, model):
+        # Convert messages to Responses API input format (with optional image)
+        input_data = _messages_to_responses_input(messages, image_data_url)
+
+        # Build Responses API request parameters
+        request_params = {
+            "model": model,
+            "input": input_data,
+            "stream": stream,
+            **kwargs
+        }
+
+        # Add web_search tool if enabled (default: True for backward compatibility)
+        if web_search is None or web_search:
+            request_params["tools"] = [{"type": "web_search"}]
+
+        # Add reasoning parameter if provided
+        if reasoning is not None:
+            request_params["reasoning"] = reasoning
+
+        # Add include parameter if provided
+        if include is not None:
+            request_params["include"] = include
+
+        return request_params
+
+    # For Together.ai and other models, use Chat Completions API
+    # Note: Image attachments are not supported for Together.ai
+    return {
+        "model": model,
+        "messages": messages,
+        "stream": stream,
+        **kwargs
+    }
+
+
 def create_openai_request(
     api_key: str,
     provider: str,
@@ -98,6 +343,7 @@ def create_openai_request(
     web_search: Optional[bool] = None,
     reasoning: Optional[Dict[str, str]] = None,
     include: Optional[List[str]] = None,
+    client: Optional[OpenAI] = None,
     **kwargs
 ) -> Union[Any, Iterator[Any]]:
     """
@@ -116,51 +362,53 @@ def create_openai_request(
         web_search: Optional bool to enable/disable web search (default: True for GPT-5 models)
         reasoning: Optional reasoning effort level ("low", "medium", "high")
         include: Optional list of additional data to include in response (e.g., ["reasoning"])
+        client: Optional pre-built client to reuse (avoids a new connection pool per call)
         **kwargs: Additional parameters (e.g., response_format, temperature)
 
     Returns:
         Response object or streaming iterator
     """
-    client = create_openai_client(api_key, provider)
+    if client is None:
+        client = create_openai_client(api_key, provider)
 
-    # For OpenAI GPT-5 models, use Responses API with web search tool
+    request_params = _build_request_params(
+        provider, model, messages, stream, image_data_url, web_search, reasoning, include, **kwargs
+    )
     if _supports_web_search(provider, model):
-        # Convert messages to Responses API input format (with optional image)
-        input_data = _messages_to_responses_input(messages, image_data_url)
-
-        # Build Responses API request parameters
-        request_params = {
-            "model": model,
-            "input": input_data,
-            "stream": stream,
-            **kwargs
-        }
-
-        # Add web_search tool if enabled (default: True for backward compatibility)
-        if web_search is None or web_search:
-            request_params["tools"] = [{"type": "web_search"}]
+        # Use Responses API for GPT-5 models with web search
+        return client.responses.create(**request_params)
+    return client.chat.completions.create(**request_params)
 
-        # Add reasoning parameter if provided
-        if reasoning is not None:
-            request_params["reasoning"] = reasoning
 
-        # Add include parameter if provided
-        if include is not None:
-            request_params["include"] = include
+async def acreate_openai_request(
+    api_key: str,
+    provider: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    stream: bool = False,
+    image_data_url: Optional[str] = None,
+    web_search: Optional[bool] = None,
+    reasoning: Optional[Dict[str, str]] = None,
+    include: Optional[List[str]] = None,
+    client: Optional[AsyncOpenAI] = None,
+    **kwargs
+) -> Any:
+    """
+    Async version of create_openai_request.
 
-        # Use Responses API for GPT-5 models with web search
-        return client.responses.create(**request_params)
-    else:
-        # For Together.ai and other models, use Chat Completions API
-        # Note: Image attachments are not supported for Together.ai
-        request_params = {
-            "model": model,
-            "messages": messages,
-            "stream": stream,
-            **kwargs
-        }
+    Same routing and parameters, but awaits an AsyncOpenAI client so the event
+    loop is never blocked. When stream=True, returns an async iterator of events.
+    """
+    if client is None:
+        base_url = "https://api.together.xyz/v1" if provider == "together" else None
+        client = get_async_openai_client(api_key, base_url)
 
-        return client.chat.completions.create(**request_params)
+    request_params = _build_request_params(
+        provider, model, messages, stream, image_data_url, web_search, reasoning, include, **kwargs
+    )
+    if _supports_web_search(provider, model):
+        return await client.responses.create(**request_params)
+    return await client.chat.completions.create(**request_params)
 
 
 def extract_response_content(response: Any, stream: bool = False) -> Union[str, Iterator[str]]:
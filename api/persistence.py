@@ -11,14 +11,26 @@ import json
 import logging
 import os
 import threading
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
 # Per-conversation message limit for Redis persistence
 MAX_MESSAGES_PER_CONVERSATION = int(os.getenv("MAX_MESSAGES_PER_CONVERSATION", "100"))
 
+# Sliding expiry for persisted sessions so abandoned ones don't accumulate in
+# Redis (refreshed on save, load and use; default: 24 hours, see .env.example)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+
+# Minimum seconds between TTL refreshes for a session served from memory, so
+# active sessions keep sliding their expiry without a Redis call per request
+SESSION_TTL_REFRESH_SECONDS = int(os.getenv("SESSION_TTL_REFRESH_SECONDS", "3600"))
+
+# session_id -> monotonic time of the last TTL refresh
+_session_refreshed_at: Dict[str, float] = {}
+
 # Redis client singleton (None if not configured)
 _redis_client = None
 _redis_initialized = False
@@ -111,33 +123,47 @@ def load_conversations(email: str) -> Dict[str, Dict[str, Any]]:
         return {}
 
 
+# Derived per-conversation caches kept in memory only (rebuilt after rehydration)
+TRANSIENT_CONVERSATION_KEYS = ("openai_messages",)
+
+
+def trim_messages(messages: List[Any]) -> List[Any]:
+    """Keep the newest MAX_MESSAGES_PER_CONVERSATION messages.
+
+    A leading summary message (prefixed with [CONVERSATION SUMMARY]) is kept
+    in front of the retained tail.
+    """
+    from context_manager import SUMMARY_PREFIX
+
+    if len(messages) <= MAX_MESSAGES_PER_CONVERSATION:
+        return messages
+
+    # Check if first message is a summary
+    first = messages[0]
+    content = first.content if hasattr(first, "content") else first.get("content", "")
+    if content.startswith(SUMMARY_PREFIX):
+        return [first] + messages[-(MAX_MESSAGES_PER_CONVERSATION - 1):]
+    return messages[-MAX_MESSAGES_PER_CONVERSATION:]
+
+
 def _trim_conversation_messages(convs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
     """Trim each conversation's messages to MAX_MESSAGES_PER_CONVERSATION.
 
-    Preserves leading summary messages (prefixed with [CONVERSATION SUMMARY]).
+    Preserves leading summary messages (prefixed with [CONVERSATION SUMMARY])
+    and drops in-memory-only caches (TRANSIENT_CONVERSATION_KEYS).
     Operates on a shallow copy to avoid mutating in-memory data.
     """
-    from context_manager import SUMMARY_PREFIX
-
     trimmed = {}
     for conv_id, conv_data in convs.items():
+        if any(key in conv_data for key in TRANSIENT_CONVERSATION_KEYS):
+            conv_data = {k: v for k, v in conv_data.items() if k not in TRANSIENT_CONVERSATION_KEYS}
         messages = conv_data.get("messages", [])
         if len(messages) <= MAX_MESSAGES_PER_CONVERSATION:
             trimmed[conv_id] = conv_data
             continue
 
-        # Check if first message is a summary
-        first = messages[0]
-        content = first.content if hasattr(first, "content") else first.get("content", "")
-        has_summary = content.startswith(SUMMARY_PREFIX)
-
-        if has_summary:
-            trimmed_msgs = [first] + messages[-(MAX_MESSAGES_PER_CONVERSATION - 1):]
-        else:
-            trimmed_msgs = messages[-MAX_MESSAGES_PER_CONVERSATION:]
-
         # Shallow copy conv_data with trimmed messages
-        trimmed[conv_id] = {**conv_data, "messages": trimmed_msgs}
+        trimmed[conv_id] = {**conv_data, "messages": trim_messages(messages)}
 
     return trimmed
 
@@ -181,7 +207,8 @@ def delete_conversations(email: str) -> None:
 def save_session(session_id: str, session_data: dict) -> None:
     """Save session to Redis as JSON (best-effort).
 
-    Excludes the `api_key` field for security. Uses key format `session:{session_id}`.
+    Excludes the `api_key` field for security. Uses key format `session:{session_id}`
+    and expires the key after SESSION_TTL_SECONDS, refreshed on every save.
     Logs errors but never raises — in-memory data is the source of truth.
     """
     redis = _get_redis_client()
@@ -193,7 +220,8 @@ def save_session(session_id: str, session_data: dict) -> None:
         # Create shallow copy excluding api_key for security
         session_copy = {k: v for k, v in session_data.items() if k != "api_key"}
         data = json.dumps(session_copy, cls=_ConversationEncoder)
-        redis.set(key, data)
+        redis.set(key, data, ex=SESSION_TTL_SECONDS)
+        _session_refreshed_at[session_id] = time.monotonic()
     except Exception as e:
         logger.warning(f"Failed to save session to Redis: {e}")
 
@@ -202,7 +230,8 @@ def load_session(session_id: str) -> Optional[dict]:
     """Load session from Redis by session ID.
 
     Returns None if not found or Redis not configured.
-    Restores api_key as None in the returned dict.
+    Restores api_key as None in the returned dict. A hit also refreshes the
+    key's TTL (GETEX), so sessions only expire once they go idle.
     """
     redis = _get_redis_client()
     if not redis:
@@ -210,9 +239,10 @@ def load_session(session_id: str) -> Optional[dict]:
 
     try:
         key = f"session:{session_id}"
-        data = redis.get(key)
+        data = redis.getex(key, ex=SESSION_TTL_SECONDS)
         if data is None:
             return None
+        _session_refreshed_at[session_id] = time.monotonic()
         # upstash-redis returns strings directly
         if isinstance(data, str):
             session_data = json.loads(data, object_hook=_conversation_decoder)
@@ -225,8 +255,32 @@ def load_session(session_id: str) -> Optional[dict]:
         return None
 
 
+def touch_session(session_id: str) -> None:
+    """Slide a persisted session's expiry forward (best-effort).
+
+    Called for sessions served from memory; refreshes at most once per
+    SESSION_TTL_REFRESH_SECONDS so active sessions outlive SESSION_TTL_SECONDS
+    without an extra Redis round-trip on every request.
+    """
+    redis = _get_redis_client()
+    if not redis:
+        return
+
+    now = time.monotonic()
+    refreshed_at = _session_refreshed_at.get(session_id)
+    if refreshed_at is not None and now - refreshed_at < SESSION_TTL_REFRESH_SECONDS:
+        return
+
+    try:
+        redis.expire(f"session:{session_id}", SESSION_TTL_SECONDS)
+        _session_refreshed_at[session_id] = now
+    except Exception as e:
+        logger.warning(f"Failed to refresh session TTL in Redis: {e}")
+
+
 def delete_session(session_id: str) -> None:
     """Delete a session from Redis (best-effort)."""
+    _session_refreshed_at.pop(session_id, None)
     redis = _get_redis_client()
     if not redis:
         return
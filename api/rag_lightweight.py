@@ -2,10 +2,13 @@
 Lightweight document processing and RAG functionality supporting PDF, Word (.docx), and PowerPoint (.pptx).
 This version avoids heavy ML dependencies for Vercel deployment.
 """
+import functools
+import io
+import logging
 import os
 import tempfile
 import uuid
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from pathlib import Path
 import re
 import mimetypes
@@ -23,13 +26,24 @@ from aimakerspace.vectordatabase import VectorDatabase
 from aimakerspace.openai_utils.embedding import EmbeddingModel
 from aimakerspace.openai_utils.chatmodel import ChatOpenAI
 
+logger = logging.getLogger(__name__)
+
+# Runs of whitespace collapsed to a single space when cleaning chunk text
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tokenizer() -> tiktoken.Encoding:
+    """Load the chunking tokenizer once per process; every DocumentProcessor shares it."""
+    return tiktoken.encoding_for_model("text-embedding-3-small")
+
 
 class DocumentProcessor:
     """Lightweight document processor supporting PDF, Word (.docx), and PowerPoint (.pptx)."""
     
     def __init__(self):
-        # Initialize tokenizer for chunking
-        self.tokenizer = tiktoken.encoding_for_model("text-embedding-3-small")
+        # Tokenizer for chunking, shared across instances (one per upload)
+        self.tokenizer = _get_tokenizer()
         
     def process_document(self, file_path: str) -> Dict[str, Any]:
         """
@@ -43,50 +57,77 @@ class DocumentProcessor:
             Dictionary containing processed content and metadata
         """
         try:
-            # Check if file exists and is readable
-            if not os.path.exists(file_path):
+            # One stat call both checks the file exists and gives its size
+            try:
+                file_size = os.stat(file_path).st_size
+            except FileNotFoundError:
                 raise Exception(f"Document file not found: {file_path}")
             
-            # Check file size (limit to 50MB to prevent memory issues)
-            file_size = os.path.getsize(file_path)
-            if file_size > 50 * 1024 * 1024:  # 50MB limit
-                raise Exception(f"Document file too large: {file_size / (1024*1024):.1f}MB (max 50MB)")
-            
-            # Detect file type
-            file_type = self._detect_file_type(file_path)
-            file_name = os.path.basename(file_path)
-            
-            print(f"Processing {file_type.upper()} document: {file_name} ({file_size / (1024*1024):.1f}MB)")
-            
-            # Extract text based on file type
-            text_content = self._extract_text_by_type(file_path, file_type)
-            
-            if not text_content.strip():
-                raise Exception(f"No text could be extracted from the {file_type} document")
-            
-            print(f"Extracted text length: {len(text_content)} characters")
-            
-            # Create chunks
-            chunks = self._create_chunks(text_content)
-            
-            print(f"Created {len(chunks)} chunks")
-            
-            return {
-                "full_text": text_content,
-                "chunks": chunks,
-                "chunk_count": len(chunks),
-                "metadata": {
-                    "file_path": file_path,
-                    "file_name": file_name,
-                    "file_type": file_type,
-                    "file_size": file_size,
-                    "processing_method": f"lightweight_{file_type}"
-                }
-            }
+            return self._process_source(file_path, os.path.basename(file_path), file_size, file_path)
             
         except Exception as e:
-            print(f"Error processing document: {str(e)}")
+            logger.error("Error processing document: %s", e)
             raise Exception(f"Error processing document: {str(e)}")
+
+    def process_document_bytes(self, content: bytes, file_name: str) -> Dict[str, Any]:
+        """
+        Process an in-memory document, e.g. an upload, without writing it to disk.
+
+        Args:
+            content: Raw document bytes
+            file_name: Original file name (used to detect the file type)
+
+        Returns:
+            Dictionary containing processed content and metadata
+        """
+        try:
+            return self._process_source(content, file_name, len(content), None)
+
+        except Exception as e:
+            logger.error("Error processing document: %s", e)
+            raise Exception(f"Error processing document: {str(e)}")
+
+    def _process_source(self, source: Union[str, bytes], file_name: str, file_size: int, file_path: Optional[str]) -> Dict[str, Any]:
+        """Extract and chunk a document given as a file path or raw bytes."""
+        # Check file size (limit to 50MB to prevent memory issues)
+        if file_size > 50 * 1024 * 1024:  # 50MB limit
+            raise Exception(f"Document file too large: {file_size / (1024*1024):.1f}MB (max 50MB)")
+        
+        # Detect file type
+        file_type = self._detect_file_type(file_name)
+        
+        logger.info("Processing %s document: %s (%.1fMB)", file_type.upper(), file_name, file_size / (1024*1024))
+        
+        # Extract text based on file type
+        text_content = self._extract_text_by_type(source, file_type)
+        
+        if not text_content.strip():
+            raise Exception(f"No text could be extracted from the {file_type} document")
+        
+        logger.debug("Extracted text length: %d characters", len(text_content))
+        
+        # Create chunks
+        chunks = self._create_chunks(text_content)
+        
+        logger.debug("Created %d chunks", len(chunks))
+        
+        return {
+            "full_text": text_content,
+            "chunks": chunks,
+            "chunk_count": len(chunks),
+            "metadata": {
+                "file_path": file_path,
+                "file_name": file_name,
+                "file_type": file_type,
+                "file_size": file_size,
+                "processing_method": f"lightweight_{file_type}"
+            }
+        }
+
+    @staticmethod
+    def _open_source(source: Union[str, bytes]):
+        """Return something the document libraries can open: a path or a fresh in-memory stream."""
+        return io.BytesIO(source) if isinstance(source, bytes) else source
     
     def _detect_file_type(self, file_path: str) -> str:
         """Detect the file type based on extension and MIME type."""
@@ -111,21 +152,21 @@ class DocumentProcessor:
             
             raise Exception(f"Unsupported file type: {file_extension}. Supported types: .pdf, .docx, .pptx")
     
-    def _extract_text_by_type(self, file_path: str, file_type: str) -> str:
-        """Extract text based on file type."""
+    def _extract_text_by_type(self, source: Union[str, bytes], file_type: str) -> str:
+        """Extract text based on file type from a file path or raw bytes."""
         if file_type == 'pdf':
-            return self._extract_text_pdf(file_path)
+            return self._extract_text_pdf(source)
         elif file_type == 'docx':
-            return self._extract_text_docx(file_path)
+            return self._extract_text_docx(source)
         elif file_type == 'pptx':
-            return self._extract_text_pptx(file_path)
+            return self._extract_text_pptx(source)
         else:
             raise Exception(f"Unsupported file type for extraction: {file_type}")
     
-    def _extract_text_pdf(self, pdf_path: str) -> str:
+    def _extract_text_pdf(self, source: Union[str, bytes]) -> str:
         """Extract text from PDF using both PyPDF2 and pdfplumber for better results."""
-        text_pypdf2 = self._extract_text_pypdf2(pdf_path)
-        text_pdfplumber = self._extract_text_pdfplumber(pdf_path)
+        text_pypdf2 = self._extract_text_pypdf2(source)
+        text_pdfplumber = self._extract_text_pdfplumber(source)
         
         # Use pdfplumber if it extracted more text, otherwise use PyPDF2
         if len(text_pdfplumber.strip()) > len(text_pypdf2.strip()):
@@ -133,117 +174,119 @@ class DocumentProcessor:
         else:
             return text_pypdf2
     
-    def _extract_text_docx(self, docx_path: str) -> str:
+    def _extract_text_docx(self, source: Union[str, bytes]) -> str:
         """Extract text from Word document (.docx)."""
         try:
-            doc = Document(docx_path)
-            text = ""
+            doc = Document(self._open_source(source))
+            # Collect lines and join once; repeated += re-copies the text so far
+            lines = []
             
             # Extract text from paragraphs
             for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
+                paragraph_text = paragraph.text
+                if paragraph_text.strip():
+                    lines.append(paragraph_text)
             
             # Extract text from tables
             for table in doc.tables:
                 for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
+                    row_text = self._row_text(row)
                     if row_text:
-                        text += " | ".join(row_text) + "\n"
+                        lines.append(row_text)
             
-            return text
+            return "".join(line + "\n" for line in lines)
         except Exception as e:
-            print(f"Word document extraction failed: {e}")
+            logger.warning("Word document extraction failed: %s", e)
             return ""
     
-    def _extract_text_pptx(self, pptx_path: str) -> str:
+    def _extract_text_pptx(self, source: Union[str, bytes]) -> str:
         """Extract text from PowerPoint presentation (.pptx)."""
         try:
-            prs = Presentation(pptx_path)
-            text = ""
+            prs = Presentation(self._open_source(source))
+            # Collect lines and join once; repeated += re-copies the text so far
+            lines = []
             
             for slide_num, slide in enumerate(prs.slides):
                 # Add slide header
-                text += f"Slide {slide_num + 1}:\n"
+                lines.append(f"Slide {slide_num + 1}:")
                 
                 # Extract text from shapes
                 for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text.strip():
-                        text += shape.text + "\n"
+                    shape_text = shape.text if hasattr(shape, "text") else ""
+                    if shape_text.strip():
+                        lines.append(shape_text)
                     
                     # Extract text from tables
                     if shape.has_table:
-                        table = shape.table
-                        for row in table.rows:
-                            row_text = []
-                            for cell in row.cells:
-                                if cell.text.strip():
-                                    row_text.append(cell.text.strip())
+                        for row in shape.table.rows:
+                            row_text = self._row_text(row)
                             if row_text:
-                                text += " | ".join(row_text) + "\n"
+                                lines.append(row_text)
                 
-                text += "\n"  # Add spacing between slides
+                lines.append("")  # Add spacing between slides
             
-            return text
+            return "".join(line + "\n" for line in lines)
         except Exception as e:
-            print(f"PowerPoint extraction failed: {e}")
+            logger.warning("PowerPoint extraction failed: %s", e)
             return ""
     
-    def _extract_text_pypdf2(self, pdf_path: str) -> str:
+    @staticmethod
+    def _row_text(row) -> str:
+        """Join a table row's non-empty cells with ' | ', reading each cell's text once."""
+        cell_texts = (cell.text.strip() for cell in row.cells)
+        return " | ".join(cell_text for cell_text in cell_texts if cell_text)
+    
+    def _extract_text_pypdf2(self, source: Union[str, bytes]) -> str:
         """Extract text using PyPDF2."""
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                # Safety check for large PDFs
-                if len(pdf_reader.pages) > 100:
-                    print(f"Warning: Large PDF detected ({len(pdf_reader.pages)} pages), processing first 50 pages only")
-                    max_pages = 50
-                else:
-                    max_pages = len(pdf_reader.pages)
-                
-                text = ""
-                for i, page in enumerate(pdf_reader.pages[:max_pages]):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                    except Exception as page_error:
-                        print(f"Error extracting page {i}: {page_error}")
-                        continue
-                        
-                return text
+            pdf_reader = PyPDF2.PdfReader(self._open_source(source))
+            
+            # Safety check for large PDFs
+            if len(pdf_reader.pages) > 100:
+                logger.warning("Large PDF detected (%d pages), processing first 50 pages only", len(pdf_reader.pages))
+                max_pages = 50
+            else:
+                max_pages = len(pdf_reader.pages)
+            
+            page_texts = []
+            for i, page in enumerate(pdf_reader.pages[:max_pages]):
+                try:
+                    page_text = page.extract_text()
+                    if page_text:
+                        page_texts.append(page_text)
+                except Exception as page_error:
+                    logger.warning("Error extracting page %d: %s", i, page_error)
+                    continue
+                    
+            return "".join(page_text + "\n" for page_text in page_texts)
         except Exception as e:
-            print(f"PyPDF2 extraction failed: {e}")
+            logger.warning("PyPDF2 extraction failed: %s", e)
             return ""
     
-    def _extract_text_pdfplumber(self, pdf_path: str) -> str:
+    def _extract_text_pdfplumber(self, source: Union[str, bytes]) -> str:
         """Extract text using pdfplumber."""
         try:
-            with pdfplumber.open(pdf_path) as pdf:
+            with pdfplumber.open(self._open_source(source)) as pdf:
                 # Safety check for large PDFs
                 if len(pdf.pages) > 100:
-                    print(f"Warning: Large PDF detected ({len(pdf.pages)} pages), processing first 50 pages only")
+                    logger.warning("Large PDF detected (%d pages), processing first 50 pages only", len(pdf.pages))
                     max_pages = 50
                 else:
                     max_pages = len(pdf.pages)
                 
-                text = ""
+                page_texts = []
                 for i, page in enumerate(pdf.pages[:max_pages]):
                     try:
                         page_text = page.extract_text()
                         if page_text:
-                            text += page_text + "\n"
+                            page_texts.append(page_text)
                     except Exception as page_error:
-                        print(f"Error extracting page {i}: {page_error}")
+                        logger.warning("Error extracting page %d: %s", i, page_error)
                         continue
                         
-                return text
+                return "".join(page_text + "\n" for page_text in page_texts)
         except Exception as e:
-            print(f"pdfplumber extraction failed: {e}")
+            logger.warning("pdfplumber extraction failed: %s", e)
             return ""
     
     def _create_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
@@ -259,52 +302,35 @@ class DocumentProcessor:
             return []
         
         try:
-            # Tokenize the text
-            tokens = self.tokenizer.encode(text)
+            # Tokenize as ordinary text: skips special-token checks, so documents
+            # containing strings like "<|endoftext|>" don't fail to encode
+            tokens = self.tokenizer.encode_ordinary(text)
             
             # Safety check for very large texts
             if len(tokens) > 100000:  # Limit to prevent memory issues
-                print(f"Warning: Large text detected ({len(tokens)} tokens), truncating...")
+                logger.warning("Large text detected (%d tokens), truncating...", len(tokens))
                 tokens = tokens[:100000]
             
-            chunks = []
-            start = 0
-            max_iterations = len(tokens) // (chunk_size - overlap) + 10  # Safety limit
-            iteration_count = 0
-            
-            while start < len(tokens) and iteration_count < max_iterations:
-                iteration_count += 1
-                
-                # Define the end of the current chunk
+            # Window starts advance by (chunk_size - overlap); stop after the
+            # window that reaches the end so the tail isn't emitted again
+            windows = []
+            for start in range(0, len(tokens), chunk_size - overlap):
                 end = min(start + chunk_size, len(tokens))
-                
-                # Extract chunk tokens
-                chunk_tokens = tokens[start:end]
-                
-                # Decode back to text
-                chunk_text = self.tokenizer.decode(chunk_tokens)
-                
-                # Clean up the chunk text
-                chunk_text = self._clean_chunk_text(chunk_text)
-                
-                if chunk_text.strip():
-                    chunks.append(chunk_text)
-                
-                # Move to the next chunk with overlap
-                start = end - overlap
-                
-                # Safety check to prevent infinite loop
-                if start >= end or start < 0:
-                    break
-                    
-                # Additional safety check
-                if start >= len(tokens):
+                windows.append(tokens[start:end])
+                if end == len(tokens):
                     break
             
+            # Decode all windows in one batched call, then clean each chunk
+            chunks = []
+            for window_text in self.tokenizer.decode_batch(windows):
+                chunk_text = self._clean_chunk_text(window_text)
+                if chunk_text:
+                    chunks.append(chunk_text)
+            
             return chunks
             
         except Exception as e:
-            print(f"Error in chunking: {e}")
+            logger.warning("Error in chunking: %s", e)
             # Fallback to simple text splitting
             return self._create_simple_chunks(text, chunk_size=1000)
     
@@ -328,7 +354,7 @@ class DocumentProcessor:
     def _clean_chunk_text(self, text: str) -> str:
         """Clean and normalize chunk text."""
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = _WHITESPACE_RE.sub(' ', text)
         # Remove leading/trailing whitespace
         text = text.strip()
         return text
@@ -408,26 +434,24 @@ class RAGSystem:
         try:
             # Check if document is already indexed
             if document_id in self.documents:
-                print(f"Document {document_id} is already indexed. Skipping indexing.")
+                logger.info("Document %s is already indexed. Skipping indexing.", document_id)
                 return
             
             # Get embeddings for all chunks
             embeddings = await self.embedding_model.async_get_embeddings(chunks)
             
-            # Store each chunk in the vector database
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_id = f"{document_id}_chunk_{i}"
-                
-                # Create metadata for this chunk
-                chunk_metadata = {
+            # Store all chunks in the vector database with batched upserts
+            chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(chunks))]
+            chunk_metadatas = [
+                {
                     "document_id": document_id,
                     "chunk_index": i,
                     "chunk_text": chunk,
                     **metadata
                 }
-                
-                # Insert into vector database
-                self.vector_db.insert(chunk_id, embedding, chunk_metadata)
+                for i, chunk in enumerate(chunks)
+            ]
+            self.vector_db.insert_many(chunk_ids, embeddings, chunk_metadatas)
             
             # Store document metadata
             self.documents[document_id] = {
@@ -435,7 +459,7 @@ class RAGSystem:
                 "metadata": metadata
             }
             
-            print(f"Successfully indexed document {document_id} with {len(chunks)} chunks.")
+            logger.info("Successfully indexed document %s with %d chunks.", document_id, len(chunks))
             
         except Exception as e:
             raise Exception(f"Error indexing document: {str(e)}")
@@ -460,7 +484,7 @@ class RAGSystem:
         except Exception as e:
             raise Exception(f"Error searching chunks: {str(e)}")
     
-    async def query_documents(self, query: str, k: int = 3, mode: str = "rag", model_name: str = "gpt-5-mini", system_message: Optional[str] = None) -> str:
+    async def query_documents(self, query: str, k: int = 3, mode: str = "rag", model_name: str = "gpt-5-mini", system_message: Optional[str] = None, relevant_chunks: Optional[List[Dict[str, Any]]] = None) -> str:
         """
         Query documents using RAG approach.
 
@@ -470,13 +494,15 @@ class RAGSystem:
             mode: Query mode ("rag" or "topic-explorer")
             model_name: Model name to use
             system_message: Custom system message to use instead of default
+            relevant_chunks: Chunks already retrieved for this query (skips the search)
 
         Returns:
             Generated response based on retrieved chunks
         """
         try:
-            # Search for relevant chunks
-            relevant_chunks = self.search_relevant_chunks(query, k=k)
+            # Search for relevant chunks unless the caller already has them
+            if relevant_chunks is None:
+                relevant_chunks = self.search_relevant_chunks(query, k=k)
 
             # Prepare context from chunks (may be empty if no documents uploaded)
             context_parts = []
@@ -554,7 +580,7 @@ class RAGSystem:
         except Exception as e:
             raise Exception(f"Error querying documents: {str(e)}")
     
-    def query(self, query: str, k: int = 3, mode: str = "rag", model_name: str = "gpt-5-mini", system_message: Optional[str] = None) -> str:
+    def query(self, query: str, k: int = 3, mode: str = "rag", model_name: str = "gpt-5-mini", system_message: Optional[str] = None, relevant_chunks: Optional[List[Dict[str, Any]]] = None) -> str:
         """
         Synchronous version of Query.
         
@@ -564,13 +590,15 @@ class RAGSystem:
             mode: Query mode ("rag" or "topic-explorer")
             model_name: OpenAI model name to use
             system_message: Custom system message to use instead of default
+            relevant_chunks: Chunks already retrieved for this query (skips the search)
         
         Returns:
             Generated response based on retrieved chunks
         """
         try:
-            # Search for relevant chunks
-            relevant_chunks = self.search_relevant_chunks(query, k=k)
+            # Search for relevant chunks unless the caller already has them
+            if relevant_chunks is None:
+                relevant_chunks = self.search_relevant_chunks(query, k=k)
 
             # Prepare context from chunks (may be empty if no documents uploaded)
             context_parts = []
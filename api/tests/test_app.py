@@ -11,11 +11,12 @@ Tests cover:
 - Token counting
 """
 
+import asyncio
 import os
 import pytest
 import pytest_asyncio
 from datetime import datetime, timezone
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock, PropertyMock
 import httpx
 
 # Set environment variables BEFORE importing the app
@@ -66,6 +67,15 @@ def mock_guest_session():
     return session_id
 
 
+@pytest.fixture
+def clean_embedding_cache():
+    """Clear the process-wide embedding cache around each test."""
+    from aimakerspace.openai_utils.embedding import _embedding_cache
+    _embedding_cache.clear()
+    yield
+    _embedding_cache.clear()
+
+
 # ============================================
 # 1. Health Endpoint Tests
 # ============================================
@@ -411,6 +421,20 @@ def test_chat_request_invalid_conversation_id():
     assert "invalid characters" in str(exc_info.value)
 
 
+def test_chat_request_rejects_conversation_id_with_trailing_newline():
+    """Test that conversation_id must match the allowed characters in full."""
+    from app import ChatRequest
+    from pydantic import ValidationError
+
+    with pytest.raises(ValidationError) as exc_info:
+        ChatRequest(
+            user_message="Hello",
+            developer_message="System",
+            conversation_id="conv-123\n"
+        )
+    assert "invalid characters" in str(exc_info.value)
+
+
 def test_session_request_valid():
     """Test SessionRequest with valid data."""
     from app import SessionRequest
@@ -600,15 +624,70 @@ async def test_clear_all_conversations(client, clean_state, mock_session):
     assert len(user_convs) == 0
 
 
+def test_fast_json_response_matches_default_encoding():
+    """Test that orjson rendering produces the same JSON as FastAPI's default encoder."""
+    import json
+    from fastapi.encoders import jsonable_encoder
+    from app import FastJSONResponse, Message
+
+    now = datetime.now(timezone.utc)
+    content = {
+        "created_at": now,
+        "messages": [
+            {"role": "user", "content": "Hi", "timestamp": now, "image_attachment": None},
+            Message(role="assistant", content="Hello", timestamp=now),
+        ],
+    }
+
+    body = FastJSONResponse(content).body
+
+    assert json.loads(body) == jsonable_encoder(content)
+
+
+def test_conversation_store_evicts_least_recently_used_session():
+    """Test that the conversation store stays bounded by evicting the LRU session."""
+    from app import ConversationStore
+
+    store = ConversationStore(max_size=2, ttl=3600)
+    store["s1"] = {"c1": {}}
+    store["s2"] = {"c2": {}}
+    store["s1"]  # touch s1 so s2 becomes least recently used
+    store["s3"] = {"c3": {}}
+
+    assert "s1" in store and "s3" in store
+    assert "s2" not in store
+    assert len(store) == 2
+
+
+def test_conversation_store_expires_idle_sessions():
+    """Test that sessions idle past the TTL are dropped from memory."""
+    from app import ConversationStore
+
+    store = ConversationStore(max_size=10, ttl=60)
+    with patch("app.time.monotonic", return_value=1000.0):
+        store["s1"] = {"c1": {}}
+    with patch("app.time.monotonic", return_value=1030.0):
+        assert store["s1"] == {"c1": {}}
+    with patch("app.time.monotonic", return_value=1080.0):
+        assert "s1" in store  # the read at t=1030 refreshed it
+    with patch("app.time.monotonic", return_value=1200.0):
+        assert "s1" not in store
+        assert store.get("s1") is None
+
+
 # ============================================
 # 7. Chat Endpoint Model Forwarding Tests
 # ============================================
 
+async def _async_iter(items):
+    """Async iterator over items, standing in for an SDK streaming response."""
+    for item in items:
+        yield item
+
+
 @pytest.mark.asyncio
 async def test_chat_endpoint_forwards_selected_model_to_provider(client, clean_state, mock_session):
     """Test POST /api/chat forwards the requested model unchanged to the provider SDK."""
-    from openai_helper import create_openai_client
-
     # For GPT-5 models, we now use Responses API which has a different streaming format
     # Events have 'type' field and text deltas are in 'delta' attribute
     stream_chunk = MagicMock()
@@ -616,9 +695,9 @@ async def test_chat_endpoint_forwards_selected_model_to_provider(client, clean_s
     stream_chunk.delta = "Hello from GPT-5"
 
     mock_client = MagicMock()
-    mock_client.responses.create.return_value = iter([stream_chunk])
+    mock_client.responses.create = AsyncMock(return_value=_async_iter([stream_chunk]))
 
-    with patch("openai_helper.create_openai_client", return_value=mock_client):
+    with patch("openai_helper.get_async_openai_client", return_value=mock_client):
         response = await client.post(
             "/api/chat",
             headers={"X-Session-ID": mock_session},
@@ -651,6 +730,46 @@ async def test_chat_endpoint_forwards_selected_model_to_provider(client, clean_s
     assert not mock_client.chat.completions.create.called
 
 
+@pytest.mark.asyncio
+async def test_chat_endpoint_stores_messages_as_plain_dicts(client, clean_state, mock_session):
+    """Test that chat turns are stored as dicts and still served by GET /api/conversations/{id}."""
+    from app import get_session_conversations
+
+    stream_chunk = MagicMock()
+    stream_chunk.type = "response.output_text.delta"
+    stream_chunk.delta = "Hi there"
+
+    mock_client = MagicMock()
+    mock_client.responses.create = AsyncMock(return_value=_async_iter([stream_chunk]))
+
+    with patch("openai_helper.get_async_openai_client", return_value=mock_client):
+        response = await client.post(
+            "/api/chat",
+            headers={"X-Session-ID": mock_session},
+            json={
+                "developer_message": "You are a helpful assistant.",
+                "user_message": "Say hello",
+                "model": "gpt-5",
+                "provider": "openai"
+            }
+        )
+
+    conversation_id = response.headers["x-conversation-id"]
+    stored = get_session_conversations(mock_session)[conversation_id]["messages"]
+    assert all(isinstance(m, dict) for m in stored)
+    assert [(m["role"], m["content"]) for m in stored] == [("user", "Say hello"), ("assistant", "Hi there")]
+
+    response = await client.get(
+        f"/api/conversations/{conversation_id}",
+        headers={"X-Session-ID": mock_session}
+    )
+    assert response.status_code == 200
+    messages = response.json()["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert messages[0]["image_attachment"] is None
+    assert messages[0]["timestamp"]
+
+
 # ============================================
 # 8. RAG Endpoint Model Forwarding Tests
 # ============================================
@@ -698,7 +817,8 @@ async def test_rag_query_endpoint_forwards_selected_model_to_rag_system(client,
         k=3,
         mode="rag",
         model_name="gpt-5",
-        system_message="Answer using the uploaded docs."
+        system_message="Answer using the uploaded docs.",
+        relevant_chunks=[{"id": "c1"}, {"id": "c2"}]
     )
     mock_rag_system.search_relevant_chunks.assert_called_once_with("Summarize the document", k=3)
 
@@ -1130,6 +1250,35 @@ class TestCompressConversation:
         user_msg = call_args[1]["messages"][1]["content"]
         assert "Old summary" in user_msg
 
+    @pytest.mark.asyncio
+    async def test_async_compression_awaits_client(self):
+        from context_manager import acompress_conversation, SUMMARY_PREFIX
+
+        mock_client = MagicMock()
+        mock_client.chat.completions.create = AsyncMock(return_value=MagicMock(
+            choices=[MagicMock(message=MagicMock(content="Summary of old msgs"))]
+        ))
+
+        messages = [{"role": "user", "content": f"Message {i}"} for i in range(10)]
+        result = await acompress_conversation(messages, mock_client, "gpt-5", "system", keep_recent=3)
+
+        mock_client.chat.completions.create.assert_awaited_once()
+        assert len(result) == 4
+        assert result[0]["content"] == f"{SUMMARY_PREFIX} Summary of old msgs"
+        assert [m["content"] for m in result[1:]] == ["Message 7", "Message 8", "Message 9"]
+
+    @pytest.mark.asyncio
+    async def test_async_compression_failure_returns_recent_only(self):
+        from context_manager import acompress_conversation
+
+        mock_client = MagicMock()
+        mock_client.chat.completions.create = AsyncMock(side_effect=Exception("API error"))
+
+        messages = [{"role": "user", "content": f"Msg {i}"} for i in range(10)]
+        result = await acompress_conversation(messages, mock_client, "gpt-5", "system", keep_recent=3)
+
+        assert [m["content"] for m in result] == ["Msg 7", "Msg 8", "Msg 9"]
+
 
 class TestTrimMessagesForPersistence:
     """Tests for trim_messages_for_persistence."""
@@ -1184,6 +1333,37 @@ class TestPersistenceTrimIntegration:
         result = _trim_conversation_messages(convs)
         assert len(result["conv-1"]["messages"]) == 1
 
+    def test_drops_in_memory_history_cache(self):
+        from persistence import _trim_conversation_messages
+        history = [{"role": "user", "content": "Hi"}]
+        convs = {
+            "conv-1": {
+                "messages": [{"role": "user", "content": "Hi"}],
+                "openai_messages": history,
+                "title": "Test",
+            }
+        }
+        result = _trim_conversation_messages(convs)
+        assert "openai_messages" not in result["conv-1"]
+        assert convs["conv-1"]["openai_messages"] is history
+
+
+def test_openai_history_formats_only_new_turns():
+    """Test that the cached LLM history is extended with new turns instead of rebuilt."""
+    from app import get_openai_history
+
+    conv_data = {"messages": [{"role": "user", "content": "Hi", "timestamp": None}]}
+    history = get_openai_history(conv_data)
+    assert history == [{"role": "user", "content": "Hi"}]
+
+    conv_data["messages"].append({"role": "assistant", "content": "Hello!", "timestamp": None})
+    assert get_openai_history(conv_data) is history
+    assert history == [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+
+    # Messages replaced by a shorter list (e.g. compression) force a rebuild
+    conv_data["messages"] = [{"role": "user", "content": "Summary", "timestamp": None}]
+    assert get_openai_history(conv_data) == [{"role": "user", "content": "Summary"}]
+
 
 # ============================================
 # Session Persistence Tests
@@ -1255,9 +1435,11 @@ def test_session_api_key_not_persisted(clean_state):
 
     # Track what gets written to Redis
     written_data = {}
+    expiries = {}
 
-    def mock_set(key, value):
+    def mock_set(key, value, ex=None):
         written_data[key] = value
+        expiries[key] = ex
 
     mock_redis = MagicMock()
     mock_redis.set = mock_set
@@ -1288,11 +1470,55 @@ def test_session_api_key_not_persisted(clean_state):
         assert "api_key" not in stored_data
         assert stored_data["auth_type"] == "api_key"
         assert stored_data["has_own_api_key"] is True
+        assert expiries[key] == persistence.SESSION_TTL_SECONDS
     finally:
         persistence._redis_client = original_client
         persistence._redis_initialized = original_initialized
 
 
+def test_session_ttl_slides_on_load_and_use(clean_state):
+    """Test that loading or using a session refreshes its Redis TTL, throttled for in-memory hits."""
+    import json
+    from persistence import load_session, touch_session
+
+    mock_redis = MagicMock()
+    mock_redis.getex = MagicMock(return_value=json.dumps({"auth_type": "api_key", "provider": "openai"}))
+
+    original_client = persistence._redis_client
+    original_initialized = persistence._redis_initialized
+    persistence._redis_client = mock_redis
+    persistence._redis_initialized = True
+    persistence._session_refreshed_at.clear()
+
+    try:
+        session = load_session("ttl-session")
+        assert session["auth_type"] == "api_key"
+        mock_redis.getex.assert_called_once_with("session:ttl-session", ex=persistence.SESSION_TTL_SECONDS)
+
+        # Just refreshed by the load, so an immediate in-memory hit skips Redis
+        touch_session("ttl-session")
+        mock_redis.expire.assert_not_called()
+
+        # Once the refresh interval has passed, the next hit slides the expiry
+        persistence._session_refreshed_at["ttl-session"] -= persistence.SESSION_TTL_REFRESH_SECONDS
+        touch_session("ttl-session")
+        mock_redis.expire.assert_called_once_with("session:ttl-session", persistence.SESSION_TTL_SECONDS)
+    finally:
+        persistence._session_refreshed_at.clear()
+        persistence._redis_client = original_client
+        persistence._redis_initialized = original_initialized
+
+
+def test_get_session_cache_hit_refreshes_ttl(clean_state):
+    """Test that an in-memory session hit slides the persisted session's expiry."""
+    session_id = create_session(auth_type="api_key", api_key="test-key", provider="openai")
+
+    with patch("app.touch_session") as mock_touch:
+        assert get_session(session_id) is not None
+
+    mock_touch.assert_called_once_with(session_id)
+
+
 def test_get_session_no_expiry(clean_state):
     """Test sessions don't expire based on age (no TTL logic)."""
     from datetime import timedelta
@@ -1510,22 +1736,19 @@ async def test_guest_session_no_persistence_load_after_cache_clear(client, clean
 async def test_chat_with_gpt5_enables_web_search(client, clean_state):
     """Test that chat requests with GPT-5 models enable web search via Responses API."""
     import app as app_module
-    from openai_helper import create_openai_request
 
     # Create a session with OpenAI API key
     session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
 
-    # Mock the create_openai_request to capture parameters
-    with patch('app.create_openai_request') as mock_helper:
+    # Mock the acreate_openai_request to capture parameters
+    with patch('app.acreate_openai_request', new_callable=AsyncMock) as mock_helper:
         # Configure mock to return a Responses API streaming response
         # (GPT-5 models use Responses API format with type and delta)
         mock_event = MagicMock()
         mock_event.type = "response.output_text.delta"
         mock_event.delta = "Test response"
 
-        mock_stream = MagicMock()
-        mock_stream.__iter__ = Mock(return_value=iter([mock_event]))
-        mock_helper.return_value = mock_stream
+        mock_helper.return_value = _async_iter([mock_event])
 
         # Send chat request with GPT-5 model
         response = await client.post(
@@ -1558,14 +1781,12 @@ async def test_chat_with_together_no_web_search(client, clean_state):
     # Create a session with Together API key
     session_id = create_session(auth_type="api_key", api_key="test-together-key", provider="together")
 
-    # Mock the create_openai_request to capture parameters
-    with patch('app.create_openai_request') as mock_helper:
+    # Mock the acreate_openai_request to capture parameters
+    with patch('app.acreate_openai_request', new_callable=AsyncMock) as mock_helper:
         # Configure mock to return a mock streaming response
-        mock_stream = MagicMock()
-        mock_stream.__iter__ = Mock(return_value=iter([
+        mock_helper.return_value = _async_iter([
             MagicMock(choices=[MagicMock(delta=MagicMock(content="Test response"))])
-        ]))
-        mock_helper.return_value = mock_stream
+        ])
 
         # Send chat request with Together.ai model
         response = await client.post(
@@ -1671,6 +1892,566 @@ def test_chatmodel_uses_helper_for_gpt5():
         assert call_kwargs["provider"] == "openai"
         assert call_kwargs["model"] == "gpt-5-mini"
         assert call_kwargs["stream"] is False
+        # The instance's pre-built client is reused rather than created per call
+        assert call_kwargs["client"] is chat._client
+
+
+@pytest.mark.asyncio
+async def test_chatmodel_arun_uses_shared_async_client():
+    """Test that ChatOpenAI.arun awaits the instance's AsyncOpenAI client."""
+    from aimakerspace.openai_utils.chatmodel import ChatOpenAI
+
+    chat = ChatOpenAI(api_key="test-key", provider="together")
+    mock_response = MagicMock(choices=[MagicMock(message=MagicMock(content="Async response"))])
+
+    with patch.object(chat._aclient.chat.completions, "create", AsyncMock(return_value=mock_response)) as mock_create:
+        result = await chat.arun(
+            messages=[{"role": "user", "content": "test"}],
+            model_name="meta-llama/Llama-3.3-70B-Instruct-Turbo"
+        )
+
+    assert result == "Async response"
+    mock_create.assert_awaited_once()
+
+
+
+@pytest.mark.asyncio
+async def test_embedding_batches_post_directly_to_embeddings_endpoint(clean_embedding_cache):
+    """Test that async_get_embeddings posts raw batches and keeps input order."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai", batch_size=2)
+
+    def make_response(texts):
+        # Return items out of order to verify they are re-aligned by index
+        return httpx.Response(200, json={"data": [
+            {"index": i, "embedding": [float(len(t))]} for i, t in reversed(list(enumerate(texts)))
+        ]}, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+
+    mock_http = MagicMock()
+    mock_http.post = AsyncMock(side_effect=lambda url, json, headers: make_response(json["input"]))
+
+    with patch.object(model, "_get_http_client", return_value=mock_http):
+        result = await model.async_get_embeddings(["a", "bb", "ccc"])
+
+    assert result == [[1.0], [2.0], [3.0]]
+    assert mock_http.post.await_count == 2
+    url = mock_http.post.call_args[0][0]
+    assert url == "https://api.openai.com/v1/embeddings"
+    assert "test-key" not in url
+    assert mock_http.post.call_args[1]["headers"]["Authorization"] == "Bearer test-key"
+
+
+@pytest.mark.asyncio
+async def test_together_embedding_batches_run_concurrently_in_order(clean_embedding_cache):
+    """Test that Together.ai batches are split and reassembled in input order."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="together", batch_size=2)
+
+    with patch.object(model, "_create_embeddings", side_effect=lambda batch: [[float(len(t))] for t in batch]) as mock_get:
+        result = await model.async_get_embeddings(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert result == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert mock_get.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_embedding_inflight_requests_are_bounded_across_calls(clean_embedding_cache):
+    """Test that concurrent async_get_embeddings calls share one in-flight limit."""
+    import aimakerspace.openai_utils.embedding as embedding_module
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai", batch_size=1)
+    in_flight = 0
+    peak = 0
+
+    async def slow_post(batch):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return [[1.0] for _ in batch]
+
+    with patch.object(embedding_module, "OPENAI_MAX_CONCURRENT", 2), \
+         patch.object(embedding_module, "_inflight_semaphores", embedding_module.weakref.WeakKeyDictionary()), \
+         patch.object(model, "_post_embeddings", side_effect=slow_post):
+        await asyncio.gather(
+            model.async_get_embeddings([f"a{i}" for i in range(4)]),
+            model.async_get_embeddings([f"b{i}" for i in range(4)]),
+        )
+
+    assert peak == 2
+
+
+def test_embedding_model_dispatches_to_provider_subclass():
+    """Test that EmbeddingModel resolves the provider once at construction."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel, _OpenAIEmbedder, _TogetherEmbedder
+
+    together = EmbeddingModel(api_key="test-key", provider="Together")
+    openai_model = EmbeddingModel(api_key="test-key")
+
+    assert isinstance(together, _TogetherEmbedder) and isinstance(together, EmbeddingModel)
+    assert together.provider == "together"
+    assert together.embeddings_model_name == "Alibaba-NLP/gte-modernbert-base"
+    assert isinstance(openai_model, _OpenAIEmbedder)
+    assert openai_model.embeddings_model_name == "text-embedding-3-small"
+    with pytest.raises(ValueError):
+        EmbeddingModel(provider="openai")
+
+
+def test_embedding_subclasses_must_implement_provider_hooks():
+    """Test that a provider subclass missing the abstract hooks cannot be instantiated."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    class IncompleteEmbedder(EmbeddingModel):
+        provider = "incomplete"
+
+    with pytest.raises(TypeError):
+        IncompleteEmbedder(api_key="test-key")
+
+
+def test_embedding_batches_are_packed_by_token_budget():
+    """Test that batches respect both the token budget and the item cap."""
+    import aimakerspace.openai_utils.embedding as embedding_module
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai", batch_size=3)
+    texts = ["word " * 4, "word " * 4, "word", "word", "word", "word", "word " * 20]
+
+    with patch.object(embedding_module, "MAX_EMBEDDING_TOKENS_PER_REQUEST", 10):
+        batches = model._pack_batches(texts)
+
+    assert batches == [texts[0:2], texts[2:5], texts[5:6], texts[6:7]]
+    assert [t for batch in batches for t in batch] == texts
+
+
+@pytest.mark.asyncio
+async def test_concurrent_single_embeddings_are_coalesced(clean_embedding_cache):
+    """Test that concurrent async_get_embedding calls share one batched request."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+
+    with patch.object(model, "_post_embeddings", AsyncMock(side_effect=lambda batch: [[float(len(t))] for t in batch])) as mock_post:
+        results = await asyncio.gather(
+            model.async_get_embedding("a"),
+            model.async_get_embedding("bb"),
+            model.async_get_embedding("ccc"),
+        )
+
+    assert results == [[1.0], [2.0], [3.0]]
+    mock_post.assert_awaited_once_with(["a", "bb", "ccc"])
+
+
+@pytest.mark.asyncio
+async def test_coalesced_embeddings_respect_token_budget(clean_embedding_cache):
+    """Test that a coalesced burst of long texts is split under the per-request token budget."""
+    import aimakerspace.openai_utils.embedding as embedding_module
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+    texts = ["word " * 8, "more " * 8, "text " * 8]
+
+    with patch.object(embedding_module, "MAX_EMBEDDING_TOKENS_PER_REQUEST", 10), \
+            patch.object(model, "_post_embeddings", AsyncMock(side_effect=lambda batch: [[float(len(t))] for t in batch])) as mock_post:
+        results = await asyncio.gather(*[model.async_get_embedding(text) for text in texts])
+
+    assert results == [[float(len(t))] for t in texts]
+    assert sorted(call.args[0] for call in mock_post.await_args_list) == sorted([t] for t in texts)
+
+
+@pytest.mark.asyncio
+async def test_coalesced_embedding_errors_propagate_to_callers(clean_embedding_cache):
+    """Test that a failed batch raises in every waiting caller."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+
+    with patch.object(model, "_post_embeddings", AsyncMock(side_effect=RuntimeError("boom"))):
+        results = await asyncio.gather(
+            model.async_get_embedding("a"),
+            model.async_get_embedding("b"),
+            return_exceptions=True,
+        )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_embedding_batch_job_submit_and_collect():
+    """Test that Batch API jobs are submitted as JSONL and collected in input order."""
+    import json as json_module
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+    client = MagicMock()
+    client.files.create = AsyncMock(return_value=MagicMock(id="file-in"))
+    client.batches.create = AsyncMock(return_value=MagicMock(id="batch-1"))
+    client.batches.retrieve = AsyncMock(return_value=MagicMock(status="completed", output_file_id="file-out"))
+    output_lines = [
+        json_module.dumps({"custom_id": str(i), "response": {"status_code": 200, "body": {"data": [{"embedding": [float(i)]}]}}})
+        for i in (1, 0)
+    ]
+    client.files.content = AsyncMock(return_value=MagicMock(text="\n".join(output_lines)))
+    with patch.object(type(model), "async_client", new_callable=PropertyMock, return_value=client):
+        result = await model.submit_batch_job(["first", "second"], poll=True)
+
+    assert result == [[0.0], [1.0]]
+    uploaded = client.files.create.call_args[1]["file"][1].decode().splitlines()
+    assert json_module.loads(uploaded[1])["body"]["input"] == "second"
+    assert client.batches.create.call_args[1]["endpoint"] == "/v1/embeddings"
+
+
+@pytest.mark.asyncio
+async def test_embedding_batch_job_requires_openai_provider():
+    """Test that Batch API jobs are rejected for Together.ai."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="together")
+    with pytest.raises(ValueError):
+        await model.submit_batch_job(["text"])
+
+
+@pytest.mark.asyncio
+async def test_with_retries_retries_rate_limits_then_succeeds():
+    """Test that transient 429s are retried, honoring Retry-After."""
+    from openai_helper import with_retries
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    throttled = httpx.Response(429, headers={"retry-after": "2"}, request=request)
+    error = httpx.HTTPStatusError("rate limited", request=request, response=throttled)
+    fn = AsyncMock(side_effect=[error, "ok"])
+
+    with patch("openai_helper.asyncio.sleep", AsyncMock()) as mock_sleep:
+        result = await with_retries(fn)
+
+    assert result == "ok"
+    assert fn.await_count == 2
+    mock_sleep.assert_awaited_once_with(2.0)
+
+
+@pytest.mark.asyncio
+async def test_with_retries_does_not_retry_client_errors():
+    """Test that non-transient errors are raised immediately."""
+    from openai_helper import with_retries
+
+    fn = AsyncMock(side_effect=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        await with_retries(fn)
+    assert fn.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_async_get_embeddings_np_returns_float32_matrix(clean_embedding_cache):
+    """Test that embeddings can be returned as one contiguous float32 array."""
+    import numpy as np
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai", batch_size=2)
+
+    with patch.object(model, "_post_embeddings", AsyncMock(side_effect=lambda batch: [[float(len(t)), 0.5] for t in batch])):
+        result = await model.async_get_embeddings_np(["a", "bb", "ccc"])
+
+    assert result.dtype == np.float32
+    assert result.shape == (3, 2)
+    assert result[:, 0].tolist() == [1.0, 2.0, 3.0]
+
+
+def test_get_embeddings_int8_round_trips_within_tolerance(clean_embedding_cache):
+    """Test that int8 quantization preserves vectors up to one quantization step."""
+    import numpy as np
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+    vectors = [[0.5, -0.25, 0.1], [0.0, 0.0, 0.0]]
+
+    with patch.object(model, "get_embeddings", return_value=vectors):
+        q, scales = model.get_embeddings_int8(["a", "b"])
+
+    assert q.dtype == np.int8 and scales.dtype == np.float32
+    assert q[0].tolist() == [127, -64, 25]
+    restored = q.astype(np.float32) * scales[:, None]
+    assert np.allclose(restored, np.asarray(vectors, dtype=np.float32), atol=scales.max())
+    assert q[1].tolist() == [0, 0, 0]
+
+
+@pytest.mark.asyncio
+async def test_chatmodel_astream_yields_incremental_text():
+    """Test that ChatOpenAI.astream yields deltas from both API formats."""
+    from aimakerspace.openai_utils.chatmodel import ChatOpenAI
+
+    async def fake_stream(items):
+        for item in items:
+            yield item
+
+    chat = ChatOpenAI(api_key="test-key", provider="openai")
+    events = [
+        MagicMock(type="response.reasoning_summary_text.delta", delta="thinking"),
+        MagicMock(type="response.output_text.delta", delta="Hello"),
+        MagicMock(type="response.output_text.delta", delta=" world"),
+    ]
+    with patch.object(chat._aclient.responses, "create", AsyncMock(return_value=fake_stream(events))) as mock_create:
+        chunks = [c async for c in chat.astream([{"role": "user", "content": "hi"}], model_name="gpt-5-mini")]
+    assert chunks == ["Hello", " world"]
+    assert mock_create.call_args[1]["stream"] is True
+
+    together = ChatOpenAI(api_key="test-key", provider="together")
+    completion_chunks = [
+        MagicMock(choices=[MagicMock(delta=MagicMock(content="Hi"))]),
+        MagicMock(choices=[]),
+        MagicMock(choices=[MagicMock(delta=MagicMock(content=None))]),
+    ]
+    with patch.object(together._aclient.chat.completions, "create", AsyncMock(return_value=fake_stream(completion_chunks))):
+        chunks = [c async for c in together.astream([{"role": "user", "content": "hi"}], model_name="meta-llama/Llama-3.3-70B-Instruct-Turbo")]
+    assert chunks == ["Hi"]
+
+
+@pytest.mark.asyncio
+async def test_chatmodel_and_embedding_share_cached_clients():
+    """Test that instances with the same key reuse one cached SDK client."""
+    from aimakerspace.openai_utils.chatmodel import ChatOpenAI
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    first = ChatOpenAI(api_key="shared-key", provider="openai")
+    second = ChatOpenAI(api_key="shared-key", provider="openai")
+    embedder = EmbeddingModel(api_key="shared-key", provider="openai")
+    other = ChatOpenAI(api_key="shared-key", provider="together")
+
+    assert first._client is second._client
+    assert first._aclient is second._aclient
+    assert embedder.client is first._client
+    assert embedder.async_client is first._aclient
+    assert other._client is not first._client
+
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_only_requests_misses(clean_embedding_cache):
+    """Test that cached texts are served locally and only misses hit the API."""
+    from aimakerspace.openai_utils.embedding import EmbeddingModel
+
+    model = EmbeddingModel(api_key="test-key", provider="openai")
+    mock_post = AsyncMock(side_effect=lambda batch: [[float(len(t))] for t in batch])
+
+    with patch.object(model, "_post_embeddings", mock_post):
+        first = await model.async_get_embeddings(["a", "bb"])
+        second = await model.async_get_embeddings(["bb", "ccc", "a"])
+        single = await model.async_get_embedding("ccc")
+
+    assert first == [[1.0], [2.0]]
+    assert second == [[2.0], [3.0], [1.0]]
+    assert single == [3.0]
+    assert [call.args[0] for call in mock_post.await_args_list] == [["a", "bb"], ["ccc"]]
+
+
+
+# ============================================
+# Vector Database Tests
+# ============================================
+
+def _make_vector_db(vectors_by_text):
+    """Build a VectorDatabase backed by a fake embedding model."""
+    from aimakerspace.vectordatabase import VectorDatabase
+
+    embedding_model = MagicMock()
+    embedding_model.async_get_embeddings = AsyncMock(side_effect=lambda texts: [vectors_by_text[t] for t in texts])
+    embedding_model.get_embedding = MagicMock(side_effect=lambda text: vectors_by_text[text])
+    return VectorDatabase(embedding_model=embedding_model)
+
+
+@pytest.mark.asyncio
+async def test_vector_db_build_from_list_batches_upserts():
+    """Test that abuild_from_list upserts points in chunks rather than one by one."""
+    vectors = {f"text {i}": [1.0, float(i)] for i in range(5)}
+    vector_db = _make_vector_db(vectors)
+    vector_db.UPSERT_BATCH_SIZE = 2
+
+    with patch.object(vector_db.client, "upsert", wraps=vector_db.client.upsert) as mock_upsert:
+        await vector_db.abuild_from_list(list(vectors))
+
+    assert mock_upsert.call_count == 3
+    assert vector_db.retrieve_from_key("text 3") is not None
+    results = vector_db.search_by_text("text 4", k=1)
+    assert results[0][0] == "text 4"
+
+
+@pytest.mark.asyncio
+async def test_vector_db_build_from_list_embeds_length_sorted_chunks():
+    """Test that texts are embedded in length-sorted chunks but stored under their own keys."""
+    vectors = {"ccc": [0.0, 1.0], "a": [1.0, 0.0], "bb": [1.0, 1.0]}
+    vector_db = _make_vector_db(vectors)
+
+    await vector_db.abuild_from_list(["ccc", "a", "bb"], batch_size=2)
+
+    chunks = [call.args[0] for call in vector_db.embedding_model.async_get_embeddings.await_args_list]
+    assert chunks == [["a", "bb"], ["ccc"]]
+    assert vector_db.search_by_text("ccc", k=1)[0][0] == "ccc"
+    assert vector_db.search_by_text("a", k=1)[0][0] == "a"
+
+
+@pytest.mark.asyncio
+async def test_vector_db_build_from_list_embeds_duplicates_once():
+    """Test that duplicate texts are embedded once and stored as a single point per key."""
+    vectors = {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+    vector_db = _make_vector_db(vectors)
+
+    await vector_db.abuild_from_list(["a", "b", "a"])
+
+    embedded = [text for call in vector_db.embedding_model.async_get_embeddings.call_args_list for text in call.args[0]]
+    assert sorted(embedded) == ["a", "b"]
+    assert vector_db.client.count(collection_name=vector_db.collection_name).count == 2
+    assert vector_db.retrieve_from_key("a") == pytest.approx(vectors["a"])
+    assert vector_db.retrieve_from_key("b") == pytest.approx(vectors["b"])
+    assert [key for key, _ in vector_db.search([1.0, 0.0], k=2)] == ["a", "b"]
+
+
+def test_vector_db_query_cache_hits_and_invalidates_on_insert():
+    """Test that repeated text queries are cached and inserts clear the cache."""
+    vector_db = _make_vector_db({"q": [1.0, 0.0]})
+    vector_db.insert_many(["a", "b"], [[1.0, 0.0], [0.0, 1.0]], [{"doc": "x"}, {"doc": "y"}])
+
+    first = vector_db.search_with_metadata("q", k=1)
+    first[0]["doc"] = "mutated"
+    second = vector_db.search_with_metadata("q", k=1)
+    assert second[0]["doc"] == "x"
+    assert vector_db.embedding_model.get_embedding.call_count == 1
+    assert vector_db.get_query_cache_stats()["hits"] == 1
+
+    vector_db.insert("c", [1.0, 0.1])
+    vector_db.search_with_metadata("q", k=1)
+    assert vector_db.get_query_cache_stats()["misses"] == 2
+
+
+def test_vector_db_reuses_query_embeddings_across_k_and_inserts():
+    """Test that query embeddings are cached independently of result caching."""
+    vector_db = _make_vector_db({"q": [1.0, 0.0]})
+    vector_db.insert_many(["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+
+    assert vector_db.search_by_text("q", k=1, return_as_text=True) == ["a"]
+    assert vector_db.search_by_text("q", k=2, return_as_text=True) == ["a", "b"]
+    vector_db.insert("c", [0.9, 0.1])
+    vector_db.search_with_metadata("q", k=3)
+
+    assert vector_db.embedding_model.get_embedding.call_count == 1
+
+
+def test_vector_db_quantization_is_configurable():
+    """Test that collections request INT8 scalar quantization unless disabled."""
+    from aimakerspace.vectordatabase import VectorDatabase
+    from qdrant_client.models import ScalarType
+
+    quantized = VectorDatabase(embedding_model=MagicMock())
+    with patch.object(quantized.client, "create_collection", wraps=quantized.client.create_collection) as mock_create:
+        quantized.insert("a", [1.0, 0.0])
+    assert mock_create.call_args[1]["quantization_config"].scalar.type == ScalarType.INT8
+
+    plain = VectorDatabase(embedding_model=MagicMock(), enable_quantization=False)
+    with patch.object(plain.client, "create_collection", wraps=plain.client.create_collection) as mock_create:
+        plain.insert("a", [1.0, 0.0])
+    assert mock_create.call_args[1]["quantization_config"] is None
+
+
+def test_vector_db_hnsw_config_skips_graph_for_small_collections():
+    """Test that HNSW knobs reach create_collection and small collections use m=0."""
+    from aimakerspace.vectordatabase import VectorDatabase
+
+    tuned = VectorDatabase(embedding_model=MagicMock(), hnsw_m=24, hnsw_ef_construct=200)
+    with patch.object(tuned.client, "create_collection", wraps=tuned.client.create_collection) as mock_create:
+        tuned.insert("a", [1.0, 0.0])
+    hnsw_config = mock_create.call_args[1]["hnsw_config"]
+    assert (hnsw_config.m, hnsw_config.ef_construct) == (24, 200)
+
+    small = VectorDatabase(embedding_model=MagicMock(), expected_size=500)
+    with patch.object(small.client, "create_collection", wraps=small.client.create_collection) as mock_create:
+        small.insert("a", [1.0, 0.0])
+    assert mock_create.call_args[1]["hnsw_config"].m == 0
+
+
+def test_vector_db_insert_many_keeps_metadata():
+    """Test that insert_many stores metadata alongside each key."""
+    vector_db = _make_vector_db({"q": [1.0, 0.0]})
+    vector_db.insert_many(["a", "b"], [[1.0, 0.0], [0.0, 1.0]], [{"doc": "x"}, {"doc": "y"}])
+
+    assert vector_db.get_metadata("b") == {"doc": "y"}
+    assert vector_db.get_vectors_by_metadata_filter(lambda m: m.get("doc") == "x") == [{"doc": "x", "key": "a"}]
+    from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+    qdrant_filter = Filter(must=[FieldCondition(key="doc", match=MatchValue(value="y"))])
+    assert vector_db.get_vectors_by_metadata_filter(qdrant_filter=qdrant_filter) == [{"doc": "y", "key": "b"}]
+    results = vector_db.search_with_metadata("q", k=1)
+    assert results[0]["key"] == "a"
+    assert results[0]["doc"] == "x"
+
+
+def test_vector_db_creates_payload_index_once_per_field():
+    """Test that server-side filters index each payload field on first use only."""
+    from qdrant_client.models import FieldCondition, Filter, MatchValue, PayloadSchemaType
+
+    vector_db = _make_vector_db({})
+    vector_db.insert("a", [1.0, 0.0], {"doc": "x"})
+    vector_db._is_local = False  # Payload indexes only apply to a Qdrant server
+    qdrant_filter = Filter(must=[FieldCondition(key="doc", match=MatchValue(value="x"))])
+
+    with patch.object(vector_db.client, "create_payload_index") as mock_index:
+        vector_db.get_vectors_by_metadata_filter(qdrant_filter=qdrant_filter)
+        vector_db.get_vectors_by_metadata_filter(qdrant_filter=qdrant_filter)
+
+    mock_index.assert_called_once_with(
+        collection_name=vector_db.collection_name,
+        field_name="doc",
+        field_schema=PayloadSchemaType.KEYWORD,
+    )
+
+
+def test_vector_db_batch_search_by_text_batches_cache_misses():
+    """Test that batched text search sends only cache misses to Qdrant, in one call."""
+    vectors = {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+    vector_db = _make_vector_db(vectors)
+    vector_db.insert_many(["a", "b"], [vectors["a"], vectors["b"]])
+    vector_db.search_by_text("a", k=1)
+
+    with patch.object(vector_db.client, "query_batch_points", wraps=vector_db.client.query_batch_points) as mock_batch:
+        results = vector_db.batch_search_by_text(["a", "b"], k=1)
+
+    assert [hits[0][0] for hits in results] == ["a", "b"]
+    mock_batch.assert_called_once()
+    assert len(mock_batch.call_args.kwargs["requests"]) == 1
+
+
+def test_vector_db_buffers_inserts_until_read():
+    """Test that single inserts are buffered and flushed before searches."""
+    vector_db = _make_vector_db({"a": [1.0, 0.0]})
+
+    with patch.object(vector_db.client, "upsert", wraps=vector_db.client.upsert) as mock_upsert:
+        vector_db.insert("a", [1.0, 0.0], {"doc": "x"})
+        vector_db.insert("b", [0.0, 1.0], {"doc": "y"})
+        assert mock_upsert.call_count == 0
+
+        results = vector_db.search_by_text("a", k=1)
+        assert mock_upsert.call_count == 1
+        assert len(mock_upsert.call_args.kwargs["points"]) == 2
+
+        vector_db.insert_immediate("c", [1.0, 1.0])
+        assert mock_upsert.call_count == 2
+
+    assert results[0][0] == "a"
+    assert vector_db.retrieve_from_key("c") is not None
+
+
+def test_vector_db_resolves_distance_measures():
+    """Test that enum members, strings in any case, and callables map to Qdrant distances."""
+    from aimakerspace.vectordatabase import DistanceMeasure
+    from qdrant_client.models import Distance
+
+    vector_db = _make_vector_db({})
+
+    assert vector_db._get_qdrant_distance(DistanceMeasure.EUCLIDEAN) == Distance.EUCLID
+    assert vector_db._get_qdrant_distance("dot_product") == Distance.DOT
+    assert vector_db._get_qdrant_distance("Manhattan") == Distance.MANHATTAN
+    assert vector_db._get_qdrant_distance("unknown") == Distance.COSINE
+    assert vector_db._get_qdrant_distance(lambda a, b: 0.0) == Distance.COSINE
 
 
 # ============================================
@@ -1838,14 +2619,12 @@ async def test_chat_with_image_attachment(client, clean_state, mock_session):
     small_png = base64.b64encode(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde').decode()
     valid_data_url = f"data:image/png;base64,{small_png}"
 
-    # Mock the create_openai_request to capture parameters
-    with patch('app.create_openai_request') as mock_helper:
+    # Mock the acreate_openai_request to capture parameters
+    with patch('app.acreate_openai_request', new_callable=AsyncMock) as mock_helper:
         # Configure mock to return a mock streaming response
-        mock_stream = MagicMock()
-        mock_stream.__iter__ = Mock(return_value=iter([
+        mock_helper.return_value = _async_iter([
             MagicMock(type='response.output_text.delta', delta="Test response with image")
-        ]))
-        mock_helper.return_value = mock_stream
+        ])
 
         # Send chat request with image attachment
         response = await client.post(
@@ -1881,13 +2660,11 @@ async def test_image_attachment_persistence(client, clean_state, mock_session):
     small_png = base64.b64encode(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde').decode()
     valid_data_url = f"data:image/png;base64,{small_png}"
 
-    # Mock the create_openai_request to return a streaming response
-    with patch('app.create_openai_request') as mock_helper:
-        mock_stream = MagicMock()
-        mock_stream.__iter__ = Mock(return_value=iter([
+    # Mock the acreate_openai_request to return a streaming response
+    with patch('app.acreate_openai_request', new_callable=AsyncMock) as mock_helper:
+        mock_helper.return_value = _async_iter([
             MagicMock(type='response.output_text.delta', delta="I see a test image.")
-        ]))
-        mock_helper.return_value = mock_stream
+        ])
 
         # Send chat request with image attachment
         response = await client.post(
@@ -1945,13 +2722,11 @@ async def test_image_attachment_persistence(client, clean_state, mock_session):
 @pytest.mark.asyncio
 async def test_text_only_message_no_regression(client, clean_state, mock_session):
     """Test that text-only messages continue to work without image attachments."""
-    # Mock the create_openai_request to return a streaming response
-    with patch('app.create_openai_request') as mock_helper:
-        mock_stream = MagicMock()
-        mock_stream.__iter__ = Mock(return_value=iter([
+    # Mock the acreate_openai_request to return a streaming response
+    with patch('app.acreate_openai_request', new_callable=AsyncMock) as mock_helper:
+        mock_helper.return_value = _async_iter([
             MagicMock(type='response.output_text.delta', delta="Hello! How can I help?")
-        ]))
-        mock_helper.return_value = mock_stream
+        ])
 
         # Send chat request without image attachment
         response = await client.post(
@@ -2018,3 +2793,504 @@ def test_openai_helper_multimodal_input():
     assert message["content"][0]["text"] == "What's in this image?"
     assert message["content"][1]["type"] == "input_image"
     assert message["content"][1]["image_url"] == image_url
+
+
+# ============================================
+# Audio Endpoint Tests
+# ============================================
+
+@pytest.mark.asyncio
+async def test_transcribe_awaits_async_client(client, clean_state, mock_session):
+    """Test POST /api/transcribe awaits the cached async client instead of blocking."""
+    import app as app_module
+
+    mock_client = MagicMock()
+    mock_client.audio.transcriptions.create = AsyncMock(return_value=MagicMock(text="hello there"))
+
+    with patch.object(app_module, "get_async_openai_client", return_value=mock_client) as mock_get_client:
+        response = await client.post(
+            "/api/transcribe",
+            headers={"X-Session-ID": mock_session},
+            files={"audio": ("clip.webm", b"fake-audio", "audio/webm")},
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"text": "hello there"}
+    mock_get_client.assert_called_once_with("test-api-key", None)
+    assert mock_client.audio.transcriptions.create.call_args.kwargs["model"] == "gpt-4o-transcribe"
+
+
+# ============================================
+# Document Processing Tests
+# ============================================
+
+@pytest.fixture
+def document_processor():
+    """DocumentProcessor with a stub tokenizer (tiktoken encodings need network access)."""
+    from rag_lightweight import DocumentProcessor
+
+    tokenizer = MagicMock()
+    tokenizer.encode_ordinary.side_effect = lambda text: text.split()
+    tokenizer.decode_batch.side_effect = lambda batch: [" ".join(tokens) for tokens in batch]
+    with patch("rag_lightweight._get_tokenizer", return_value=tokenizer):
+        yield DocumentProcessor()
+
+
+def test_document_processors_share_one_tokenizer():
+    """Test that the chunking tokenizer is loaded once and shared by all processors."""
+    from rag_lightweight import DocumentProcessor, _get_tokenizer
+
+    _get_tokenizer.cache_clear()
+    try:
+        with patch("rag_lightweight.tiktoken.encoding_for_model", return_value=MagicMock()) as mock_load:
+            first = DocumentProcessor()
+            second = DocumentProcessor()
+
+        assert first.tokenizer is second.tokenizer
+        mock_load.assert_called_once_with("text-embedding-3-small")
+    finally:
+        _get_tokenizer.cache_clear()
+
+
+def test_process_document_bytes_reads_upload_from_memory(document_processor):
+    """Test that uploaded documents are processed from bytes without a temp file."""
+    import io
+    from docx import Document
+
+    doc = Document()
+    doc.add_paragraph("Photosynthesis turns light into chemical energy.")
+    buffer = io.BytesIO()
+    doc.save(buffer)
+
+    with patch("rag_lightweight.open", create=True) as mock_open:
+        processed = document_processor.process_document_bytes(buffer.getvalue(), "notes.docx")
+
+    mock_open.assert_not_called()
+    assert processed["metadata"]["file_type"] == "docx"
+    assert processed["metadata"]["file_name"] == "notes.docx"
+    assert processed["chunks"] == ["Photosynthesis turns light into chemical energy."]
+
+
+def test_create_chunks_overlaps_windows_without_repeating_the_tail(document_processor):
+    """Test that token windows overlap and stop once the end of the text is reached."""
+    text = " ".join(f"w{i}" for i in range(1500))
+
+    chunks = document_processor._create_chunks(text, chunk_size=1000, overlap=200)
+
+    assert len(chunks) == 2
+    assert chunks[0].split()[-1] == "w999"
+    assert chunks[1].split()[0] == "w800"
+    assert chunks[1].split()[-1] == "w1499"
+
+
+@pytest.mark.asyncio
+async def test_index_document_inserts_chunks_in_one_batch():
+    """Test that document chunks are written to the vector DB with a single batched insert."""
+    from rag_lightweight import RAGSystem
+
+    rag_system = RAGSystem(api_key="test-api-key")
+    rag_system.embedding_model.async_get_embeddings = AsyncMock(return_value=[[1.0, 0.0], [0.0, 1.0]])
+
+    with patch.object(rag_system.vector_db, "insert_many") as mock_insert_many, \
+            patch.object(rag_system.vector_db, "insert") as mock_insert:
+        await rag_system.index_document("doc.pdf", ["first chunk", "second chunk"], {"file_type": "pdf"})
+
+    mock_insert.assert_not_called()
+    mock_insert_many.assert_called_once()
+    keys, vectors, metadatas = mock_insert_many.call_args.args
+    assert keys == ["doc.pdf_chunk_0", "doc.pdf_chunk_1"]
+    assert vectors == [[1.0, 0.0], [0.0, 1.0]]
+    assert [m["chunk_text"] for m in metadatas] == ["first chunk", "second chunk"]
+    assert all(m["file_type"] == "pdf" for m in metadatas)
+    assert rag_system.documents["doc.pdf"]["chunk_count"] == 2
+
+
+def test_rag_query_reuses_prefetched_chunks():
+    """Test that RAGSystem.query skips the vector search when chunks are passed in."""
+    from rag_lightweight import RAGSystem
+
+    rag_system = RAGSystem(api_key="test-api-key")
+    rag_system.chat_model.run = Mock(return_value="answer")
+
+    with patch.object(rag_system, "search_relevant_chunks") as mock_search:
+        answer = rag_system.query("What is ATP?", relevant_chunks=[{"chunk_text": "ATP stores energy."}])
+
+    assert answer == "answer"
+    mock_search.assert_not_called()
+    messages = rag_system.chat_model.run.call_args.args[0]
+    assert "ATP stores energy." in messages[1]["content"]
+
+
+def test_process_document_reports_missing_file(document_processor, tmp_path):
+    """Test that a missing document path raises a clear error."""
+    missing = tmp_path / "missing.pdf"
+
+    with pytest.raises(Exception) as exc_info:
+        document_processor.process_document(str(missing))
+
+    assert "Document file not found" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_upload_document_summarizes_while_indexing(client, clean_state, mock_session):
+    """Test that document summarization runs concurrently with indexing."""
+    import app as app_module
+
+    summary_started = asyncio.Event()
+
+    async def fake_index_document(**kwargs):
+        # Only completes if the summary was started without waiting for indexing
+        await asyncio.wait_for(summary_started.wait(), timeout=1)
+
+    async def fake_summary(chunks, api_key, provider):
+        summary_started.set()
+        return "A short summary", ["Q1", "Q2", "Q3", "Q4", "Q5"]
+
+    mock_rag_system = MagicMock()
+    mock_rag_system.index_document = fake_index_document
+    mock_processor = MagicMock()
+    mock_processor.process_document_bytes.return_value = {
+        "chunks": ["chunk one"],
+        "chunk_count": 1,
+        "metadata": {"file_type": "pdf"}
+    }
+
+    with patch.object(app_module, "RAG_ENABLED", True), \
+            patch.object(app_module, "DocumentProcessor", return_value=mock_processor), \
+            patch.object(app_module, "get_or_create_rag_system", return_value=mock_rag_system), \
+            patch.object(app_module, "generate_document_summary", side_effect=fake_summary):
+        response = await client.post(
+            "/api/upload-document",
+            headers={"X-Session-ID": mock_session},
+            files={"file": ("notes.pdf", b"%PDF-1.4 test", "application/pdf")}
+        )
+
+    assert response.status_code == 200
+    assert response.json()["summary"] == "A short summary"
+    assert response.json()["suggested_questions"] == ["Q1", "Q2", "Q3", "Q4", "Q5"]
+
+
+@pytest.mark.asyncio
+async def test_generate_document_summary_pads_suggested_questions():
+    """Test that summaries always come back with exactly five suggested questions."""
+    import app as app_module
+
+    mock_chat_model = MagicMock()
+    mock_chat_model.arun = AsyncMock(return_value='{"summary": "About cells", "suggested_questions": ["What is ATP?"]}')
+
+    with patch.object(app_module, "ChatOpenAI", return_value=mock_chat_model):
+        summary, questions = await app_module.generate_document_summary(["chunk"], "test-api-key", "openai")
+
+    assert summary == "About cells"
+    assert questions[0] == "What is ATP?"
+    assert questions[1:] == app_module.DEFAULT_SUGGESTED_QUESTIONS[1:]
+
+
+def test_openai_clients_cached_by_hashed_key():
+    """Test that SDK clients are reused per key and cached without the raw key."""
+    import openai_helper
+
+    cache = openai_helper._ClientCache(lambda api_key, base_url: object(), maxsize=2)
+    first = cache.get("sk-secret-one")
+
+    assert cache.get("sk-secret-one") is first
+    assert cache.get("sk-secret-one", "https://api.together.xyz/v1") is not first
+    assert all("sk-secret-one" not in key_hash for key_hash, _ in cache.keys())
+
+    cache.get("sk-secret-one")
+    cache.get("sk-secret-two")
+    assert len(cache) == 2
+    assert (openai_helper._hash_api_key("sk-secret-one"), None) in cache.keys()
+
+
+@pytest.mark.asyncio
+async def test_chat_failure_removes_only_its_own_user_message(client, clean_state):
+    """Test that a failed turn rolls back its own message, not a newer one."""
+    import app as app_module
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+    conversation_id = "conv-concurrent"
+    other_turn = {"role": "user", "content": "Second tab", "timestamp": datetime.now(timezone.utc), "image_attachment": None}
+
+    async def fail_after_other_turn(**kwargs):
+        # Simulate another request on the same conversation appending meanwhile
+        app_module.get_session_conversations(session_id)[conversation_id]["messages"].append(other_turn)
+        raise RuntimeError("provider down")
+
+    with patch('app.acreate_openai_request', side_effect=fail_after_other_turn):
+        with pytest.raises(RuntimeError):
+            await client.post(
+                "/api/chat",
+                json={
+                    "user_message": "First tab",
+                    "developer_message": "You are a helpful assistant.",
+                    "model": "gpt-5",
+                    "provider": "openai",
+                    "conversation_id": conversation_id
+                },
+                headers={"X-Session-ID": session_id}
+            )
+
+    messages = app_module.get_session_conversations(session_id)[conversation_id]["messages"]
+    assert messages == [other_turn]
+
+
+@pytest.mark.asyncio
+async def test_get_conversation_paginates_messages(client, clean_state):
+    """Test that limit/before page backwards through conversation history."""
+    import app as app_module
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+    now = datetime.now(timezone.utc)
+    app_module.get_session_conversations(session_id)["conv-pages"] = {
+        "messages": [
+            {"role": "user", "content": f"m{i}", "timestamp": now, "image_attachment": None}
+            for i in range(10)
+        ],
+        "system_message": "You are a helpful assistant.",
+        "title": "Pages",
+        "created_at": now,
+        "last_updated": now,
+    }
+
+    response = await client.get("/api/conversations/conv-pages?limit=3", headers={"X-Session-ID": session_id})
+    assert [m["content"] for m in response.json()["messages"]] == ["m7", "m8", "m9"]
+    assert response.json()["total_messages"] == 10
+
+    response = await client.get("/api/conversations/conv-pages?limit=3&before=7", headers={"X-Session-ID": session_id})
+    assert [m["content"] for m in response.json()["messages"]] == ["m4", "m5", "m6"]
+
+
+def test_cap_conversation_history_keeps_summary_and_newest():
+    """Test that in-memory history is trimmed like persisted history."""
+    import app as app_module
+    from context_manager import SUMMARY_PREFIX
+
+    summary = {"role": "user", "content": f"{SUMMARY_PREFIX} earlier"}
+    conv_data = {
+        "messages": [summary] + [{"role": "user", "content": str(i)} for i in range(5)],
+        "openai_messages": [],
+    }
+
+    with patch("persistence.MAX_MESSAGES_PER_CONVERSATION", 3):
+        app_module.cap_conversation_history(conv_data)
+
+    assert conv_data["messages"] == [summary, {"role": "user", "content": "3"}, {"role": "user", "content": "4"}]
+    assert "openai_messages" not in conv_data
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_merges_small_deltas():
+    """Test that streamed deltas are merged and flushed at the size threshold."""
+    import app as app_module
+
+    chunks = [c async for c in app_module.coalesce_stream(_async_iter(["ab", "cd", "ef", "g"]), max_chars=4)]
+
+    assert chunks == ["abcd", "efg"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_flushes_when_provider_stalls():
+    """Test that buffered text is flushed after max_delay even without new deltas."""
+    import app as app_module
+
+    release = asyncio.Event()
+    received = []
+
+    async def stalled_provider():
+        yield "Hel"
+        yield "lo"
+        await release.wait()
+        yield " world"
+
+    async def consume():
+        async for chunk in app_module.coalesce_stream(stalled_provider(), max_chars=256, max_delay=0.01):
+            received.append(chunk)
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0.1)
+    assert received == ["Hello"]
+
+    release.set()
+    await task
+    assert received == ["Hello", " world"]
+
+
+@pytest.mark.asyncio
+async def test_request_bodies_parsed_with_orjson(client, clean_state):
+    """Test that routes decode JSON bodies through FastJSONRequest."""
+    import app as app_module
+
+    if app_module.orjson is None:
+        pytest.skip("orjson not installed")
+
+    chat_route = next(r for r in app_module.app.routes if getattr(r, "path", None) == "/api/chat")
+    assert isinstance(chat_route, app_module.FastJSONRoute)
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+    response = await client.post(
+        "/api/chat",
+        content=b'{"user_message": "Hi", "developer_message": ',
+        headers={"X-Session-ID": session_id, "Content-Type": "application/json"}
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_oversized_json_body_rejected_before_parsing(client, clean_state):
+    """Test that JSON bodies over MAX_JSON_BODY_BYTES get a 413 without reaching the endpoint."""
+    import app as app_module
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+
+    with patch.object(app_module, "acreate_openai_request", new_callable=AsyncMock) as mock_helper:
+        response = await client.post(
+            "/api/chat",
+            content=b" " * (app_module.MAX_JSON_BODY_BYTES + 1),
+            headers={"X-Session-ID": session_id, "Content-Type": "application/json"}
+        )
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+    mock_helper.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_oversized_body_without_content_type_rejected(client, clean_state):
+    """Test that omitting Content-Type does not bypass the body size limit."""
+    import app as app_module
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+
+    with patch.object(app_module, "acreate_openai_request", new_callable=AsyncMock) as mock_helper:
+        response = await client.post(
+            "/api/chat",
+            content=b" " * (app_module.MAX_JSON_BODY_BYTES + 1),
+            headers={"X-Session-ID": session_id}
+        )
+
+    assert response.status_code == 413
+    mock_helper.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_oversized_chunked_body_rejected(client, clean_state):
+    """Test that a chunked body with no Content-Length is counted as it arrives and rejected."""
+    import app as app_module
+
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+    chunk = b" " * (64 * 1024)
+
+    async def body():
+        for _ in range(app_module.MAX_JSON_BODY_BYTES // len(chunk) + 2):
+            yield chunk
+
+    with patch.object(app_module, "acreate_openai_request", new_callable=AsyncMock) as mock_helper:
+        response = await client.post(
+            "/api/chat",
+            content=body(),
+            headers={"X-Session-ID": session_id, "Content-Type": "application/json"}
+        )
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+    mock_helper.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_small_chunked_body_reaches_endpoint(client, clean_state):
+    """Test that a chunked body under the limit is replayed intact to the endpoint."""
+    session_id = create_session(auth_type="api_key", api_key="test-openai-key", provider="openai")
+
+    async def body():
+        yield b'{"user_message": "Hi", '
+        yield b'"developer_message": '
+
+    response = await client.post(
+        "/api/chat",
+        content=body(),
+        headers={"X-Session-ID": session_id, "Content-Type": "application/json"}
+    )
+
+    # Truncated JSON reaches FastAPI's parser instead of being rejected for size
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_aclose_clients_closes_shared_pools():
+    """Test that shutdown drops cached clients and closes the shared HTTP pool."""
+    import openai_helper
+
+    openai_helper.get_async_openai_client("sk-shutdown-test")
+    pool = openai_helper.get_shared_async_http_client()
+
+    await openai_helper.aclose_clients()
+
+    assert pool.is_closed
+    assert asyncio.get_running_loop() not in openai_helper._async_clients
+    assert openai_helper.get_shared_async_http_client() is not pool
+
+
+@pytest.fixture
+def local_openai_server():
+    """Serve a canned chat completion from a real local HTTP server; yields its /v1 base URL."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = json.dumps({
+                "id": "chatcmpl-local",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "local-model",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "pong"}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_async_client_round_trips_against_local_server(local_openai_server):
+    """Test that a cached async client on the tuned HTTP pool completes a real, unmocked request."""
+    import openai_helper
+
+    client = openai_helper.get_async_openai_client("sk-local-test", local_openai_server)
+    response = await client.chat.completions.create(
+        model="local-model", messages=[{"role": "user", "content": "ping"}]
+    )
+
+    assert response.choices[0].message.content == "pong"
+
+
+def test_async_clients_survive_successive_event_loops(local_openai_server):
+    """Test that each asyncio.run gets its own pool instead of reusing one bound to a closed loop."""
+    import openai_helper
+
+    async def ask():
+        client = openai_helper.get_async_openai_client("sk-loop-test", local_openai_server)
+        response = await client.chat.completions.create(
+            model="local-model", messages=[{"role": "user", "content": "ping"}]
+        )
+        return response.choices[0].message.content, openai_helper.get_shared_async_http_client()
+
+    first_content, first_pool = asyncio.run(ask())
+    second_content, second_pool = asyncio.run(ask())
+
+    assert first_content == second_content == "pong"
+    assert first_pool is not second_pool